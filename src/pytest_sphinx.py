@@ -9,29 +9,78 @@ https://github.com/sphinx-doc/sphinx/blob/master/sphinx/ext/doctest.py.
 
 from __future__ import annotations
 
+import argparse
+import ast
+import asyncio
+import bisect
+import collections
+import contextlib
+import copy
+import difflib
 import doctest
 import enum
+import fnmatch
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
+import inspect
+import json
+import linecache
+import os
 import re
+import runpy
+import signal
 import sys
+import tempfile
 import textwrap
+import threading
+import time
 import traceback
+import tracemalloc
+import types
+import warnings
+from collections.abc import Callable
+from collections.abc import Generator
 from collections.abc import Iterator
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.connection import Pipe
 from pathlib import Path
 from typing import TYPE_CHECKING
 from typing import Any
+from typing import NamedTuple
 
 import _pytest.doctest
 import pytest
+from _pytest._code.code import ReprFileLocation
 from _pytest.doctest import DoctestItem
+from _pytest.doctest import ReprFailDoctest
 from _pytest.main import Session
 from _pytest.pathlib import import_path
 from _pytest.python import Package
+from _pytest.runner import runtestprotocol
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on windows
+    resource = None  # type: ignore
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 if TYPE_CHECKING:
     import io
     import pdb
     from doctest import _Out
 
+    from _pytest._code.code import TerminalRepr
+
     _SpoofOut = io.StringIO
 
 
@@ -52,6 +101,10 @@ _DIRECTIVES_W_OPTIONS = (
     SphinxDoctestDirectives.TESTOUTPUT,
     SphinxDoctestDirectives.DOCTEST,
 )
+_DIRECTIVES_W_TIMEOUT = (
+    SphinxDoctestDirectives.TESTCODE,
+    SphinxDoctestDirectives.DOCTEST,
+)
 _DIRECTIVES_W_SKIPIF = (
     SphinxDoctestDirectives.TESTCODE,
     SphinxDoctestDirectives.TESTOUTPUT,
@@ -61,28 +114,593 @@ _DIRECTIVES_W_SKIPIF = (
 )
 
 
+_EVENT_LOOP_SCOPES = ("doctest", "session")
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addini(
+        "sphinx_timeout",
+        "Timeout in seconds for every example, can be overridden with the "
+        ":timeout: option of a testcode directive (default: no timeout). It is "
+        "not enforced (only warned about) for examples run in worker threads of "
+        "--sphinx-group-workers",
+        default="0",
+    )
+    parser.addini(
+        "sphinx_event_loop_scope",
+        "Lifetime of the event loop used for examples with top-level await: "
+        "one loop per doctest (default) or one loop per session",
+        default="doctest",
+    )
+    parser.addini(
+        "sphinx_result_cache_dependencies",
+        "Names of installed distributions and glob patterns (relative to the "
+        "rootdir) of files that invalidate the --sphinx-result-cache when "
+        "their version or content changes",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "sphinx_isolate",
+        "Glob patterns (relative to the rootdir) of files whose doc items are "
+        "run in a forked process, see --sphinx-isolate",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "sphinx_memory_limit",
+        "Peak memory (e.g. 512M or 2G) a doctest may allocate when "
+        "--sphinx-resource-usage is given (default: no limit)",
+        default="",
+    )
+    parser.addini(
+        "sphinx_memory_limit_action",
+        "What to do with doctests exceeding sphinx_memory_limit: warn "
+        "(default) or fail",
+        default="warn",
+    )
+    parser.addini(
+        "sphinx_conf",
+        "Path (relative to the rootdir) of the conf.py of the sphinx docs. Its "
+        "doctest_global_setup is run once per session and the resulting "
+        "namespace is added to the globals of every doctest; its "
+        "doctest_global_cleanup is run at the end of the session",
+        default="",
+    )
+    parser.addini(
+        "sphinx_dedup_includes",
+        "Run the examples of a file that is included (.. include::) in several "
+        "files in the same context only once. The namespace after the examples "
+        "is reused, so it is shared by the including files.",
+        type="bool",
+        default=False,
+    )
+    parser.addini(
+        "sphinx_extension_modules",
+        "Names of modules (e.g. C extensions) whose docstrings are collected, "
+        "when their files are collected",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "sphinx_scan_engine",
+        "How the lines with directives are found: line (default) matches the "
+        "directive regexes against every line, buffer searches the whole text "
+        "with one regex pass, which is faster for large documents",
+        default="line",
+    )
+    parser.addini(
+        "sphinx_report_max_size",
+        "Maximum size of the expected and of the actual output in the report of "
+        "a failed example (e.g. 64K). Larger outputs are truncated and written "
+        "to a spill file in full. 0 disables the truncation.",
+        default="64K",
+    )
+    group = parser.getgroup("sphinx", "sphinx doctest directives")
+    group.addoption(
+        "--sphinx-check-only",
+        action="store_true",
+        default=False,
+        help="Only check that the doctest directives can be parsed and that "
+        "the code compiles, without importing modules or running examples",
+        dest="sphinx_check_only",
+    )
+    group.addoption(
+        "--sphinx-stats",
+        action="store_true",
+        default=False,
+        help="Show the time spent in the phases of the collection of doc items "
+        "and counters of files, sections, examples and imports",
+        dest="sphinx_stats",
+    )
+    group.addoption(
+        "--sphinx-stats-json",
+        metavar="PATH",
+        default=None,
+        help="Write the collection statistics of --sphinx-stats as JSON to PATH "
+        "(implies --sphinx-stats)",
+        dest="sphinx_stats_json",
+    )
+    group.addoption(
+        "--sphinx-early-mismatch",
+        action="store_true",
+        default=False,
+        help="Abort an example as soon as its output cannot match the expected "
+        "output anymore, instead of running it to the end",
+        dest="sphinx_early_mismatch",
+    )
+    group.addoption(
+        "--sphinx-example-records",
+        action="store_true",
+        default=False,
+        help="Record the line, groups, duration and outcome of every example "
+        "as sphinx_example user properties of the doc items, which are e.g. "
+        "added to the JUnit XML properties",
+        dest="sphinx_example_records",
+    )
+    group.addoption(
+        "--sphinx-example-report",
+        metavar="PATH",
+        default=None,
+        help="Write the records of --sphinx-example-records as JSON lines to "
+        "PATH while the tests run (implies --sphinx-example-records)",
+        dest="sphinx_example_report",
+    )
+    group.addoption(
+        "--sphinx-watch",
+        action="store_true",
+        default=False,
+        help="Keep running after the tests and re-run the changed examples "
+        "(and all examples after them) of text files whenever "
+        "the files change",
+        dest="sphinx_watch",
+    )
+    group.addoption(
+        "--sphinx-group-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run the examples of distinct testcode groups of a doctest "
+        "concurrently in a pool of N threads (default: run serially). Timeouts "
+        "of examples cannot be enforced in these threads",
+        dest="sphinx_group_workers",
+    )
+    group.addoption(
+        "--sphinx-result-cache",
+        action="store_true",
+        default=False,
+        help="Don't run doc items that passed in the previous run if neither "
+        "their examples nor the sphinx_result_cache_dependencies changed",
+        dest="sphinx_result_cache",
+    )
+    group.addoption(
+        "--sphinx-shard",
+        type=_parse_shard,
+        default=None,
+        metavar="i/N",
+        help="Only run the i-th of N shards of the doc items. The items are "
+        "distributed by the durations recorded in previous runs",
+        dest="sphinx_shard",
+    )
+    group.addoption(
+        "--sphinx-isolate",
+        action="store_true",
+        default=False,
+        help="Run every doc item in a process forked from a pre-warmed fork "
+        "server, such that changes to global state don't leak into other items",
+        dest="sphinx_isolate",
+    )
+    group.addoption(
+        "--sphinx-resource-usage",
+        action="store_true",
+        default=False,
+        help="Record the peak memory (tracemalloc) and the growth of the peak "
+        "RSS of every example and report them",
+        dest="sphinx_resource_usage",
+    )
+
+
+def _parse_shard(value: str) -> tuple[int, int]:
+    """Parse the argument of --sphinx-shard, e.g. "2/16"."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            f"expected i/N with 1 <= i <= N, got {value!r}"
+        )
+    return index, count
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    config.stash[_DURATIONS_KEY] = {}
+    if config.getoption("sphinx_resource_usage") and not hasattr(config, "workerinput"):
+        # built from the reports, which also arrive from xdist workers and
+        # from the processes of --sphinx-isolate
+        summary = _ResourceUsageSummary()
+        config.stash[_RESOURCE_USAGE_KEY] = summary
+        config.pluginmanager.register(summary, "sphinx_resource_usage")
+    if config.getoption("sphinx_result_cache"):
+        if getattr(config, "cache", None) is None:
+            raise pytest.UsageError(
+                "--sphinx-result-cache requires the cacheprovider plugin"
+            )
+        result_cache = _ResultCache(config)
+        config.stash[_RESULT_CACHE_KEY] = result_cache
+        if _is_xdist_controller(config):
+            # the items are run by the workers, see `_ResultCache.record`
+            config.pluginmanager.register(result_cache, "sphinx_result_cache")
+    conf = config.getini("sphinx_conf")
+    if conf and not (config.rootpath / conf).is_file():
+        raise pytest.UsageError(f"sphinx_conf: {config.rootpath / conf} doesn't exist")
+    if config.getoption("sphinx_stats") or config.getoption("sphinx_stats_json"):
+        config.stash[_STATS_KEY] = _CollectionStats()
+    if config.getoption("sphinx_check_only"):
+        config.pluginmanager.register(_CheckOnlyCollector(), "sphinx_check_only")
+    if config.getoption("sphinx_watch") and _is_xdist_controller(config):
+        # the controller has no items to watch and the workers exit
+        raise pytest.UsageError("--sphinx-watch cannot be used with pytest-xdist")
+    example_report = config.getoption("sphinx_example_report")
+    if example_report and not hasattr(config, "workerinput"):
+        # xdist workers send their records to the controller, which writes
+        # them
+        config.pluginmanager.register(
+            _ExampleReportWriter(example_report), "sphinx_example_report"
+        )
+    memory_limit = _get_memory_limit(config)
+    if memory_limit is not None:
+        config.stash[_MEMORY_LIMIT_KEY] = memory_limit
+    scan_engine = config.getini("sphinx_scan_engine")
+    if scan_engine not in _SCAN_ENGINES:
+        raise pytest.UsageError(
+            f"sphinx_scan_engine must be one of {tuple(_SCAN_ENGINES)}, "
+            f"not {scan_engine!r}"
+        )
+
+
+class _MemoryLimit(NamedTuple):
+    """The parsed ``sphinx_memory_limit`` and ``sphinx_memory_limit_action``."""
+
+    text: str
+    size: int
+    action: str
+
+
+def _get_memory_limit(config: pytest.Config) -> _MemoryLimit | None:
+    action = config.getini("sphinx_memory_limit_action")
+    if action not in ("warn", "fail"):
+        raise pytest.UsageError(
+            f"sphinx_memory_limit_action must be warn or fail, not {action!r}"
+        )
+    limit = config.getini("sphinx_memory_limit")
+    if not limit:
+        return None
+    try:
+        size = _parse_size(limit)
+    except ValueError as e:
+        raise pytest.UsageError(f"sphinx_memory_limit: {e}") from None
+    return _MemoryLimit(limit, size, action)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_protocol(
+    item: pytest.Item, nextitem: pytest.Item | None
+) -> bool | None:
+    if not isinstance(item, SphinxDoctestItem) or not item.isolated:
+        return None
+    result_cache = item.config.stash.get(_RESULT_CACHE_KEY, None)
+    if result_cache is not None and result_cache.passed.get(item.nodeid) == (
+        result_cache.key(item)
+    ):
+        # not worth a fork, the item is not run anyway
+        return None
+    fork_server = _get_fork_server(item.session)
+    if fork_server is None:
+        return None
+    item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+    passed = True
+    for report in fork_server.run(item):
+        item.ihook.pytest_runtest_logreport(report=report)
+        passed = passed and report.passed
+        if report.when == "call":
+            item.config.stash[_DURATIONS_KEY][item.nodeid] = report.duration
+    if result_cache is not None:
+        result_cache.record(item, passed)
+    item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+    # the item was neither set up nor torn down in this process, but the
+    # collectors that nextitem doesn't need anymore still have to be torn down
+    item.session._setupstate.teardown_exact(nextitem)
+    return True
+
+
+class _CheckOnlyCollector:
+    """Plugin that drops all file collectors but those of the file checks.
+
+    Without it, the collectors of the python plugin and of pytest's doctest
+    plugin would import the modules in ``--sphinx-check-only`` mode, even if
+    their items are deselected afterwards.  Creating a collector doesn't
+    import its module, only collecting it does.
+    """
+
+    @pytest.hookimpl(wrapper=True)
+    def pytest_collect_file(self) -> Generator[None, list[Any], list[Any]]:
+        collectors = yield
+        return [c for c in collectors if isinstance(c, SphinxCheckFile)]
+
+
+class _ExampleReportWriter:
+    """Plugin that writes the example records as JSON lines to a file.
+
+    The records are taken from the ``sphinx_example`` user properties of the
+    reports (see `SphinxDoctestItem._add_example_records`) and are written
+    as soon as a report arrives, so they are never accumulated in memory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "w", encoding="utf-8")
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        # the user properties are part of the reports of all phases
+        if report.when != "call":
+            return
+        lines = [
+            json.dumps({"nodeid": report.nodeid, **json.loads(value)}) + "\n"
+            for name, value in report.user_properties
+            if name == "sphinx_example"
+        ]
+        if lines:
+            self._file.writelines(lines)
+            self._file.flush()
+
+    def pytest_unconfigure(self) -> None:
+        self._file.close()
+
+
+def _is_xdist_controller(config: pytest.Config) -> bool:
+    """Whether this process distributes the items to pytest-xdist workers."""
+    return getattr(config.option, "dist", "no") != "no" and not hasattr(
+        config, "workerinput"
+    )
+
+
+class _ResourceUsageSummary:
+    """Plugin that collects the resource usage of the doc items.
+
+    The usage is taken from the ``sphinx_peak_memory``,
+    ``sphinx_peak_memory_lineno`` and ``sphinx_rss_delta`` user properties of
+    the reports (see `SphinxDoctestItem._check_resource_usage`).
+    """
+
+    def __init__(self) -> None:
+        self.usage: dict[str, ResourceUsage] = {}
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if report.when != "call":
+            return
+        properties = dict(report.user_properties)
+        if "sphinx_peak_memory" not in properties:
+            return
+        self.usage[report.nodeid] = ResourceUsage(
+            properties.get("sphinx_peak_memory_lineno"),
+            properties["sphinx_peak_memory"],
+            properties.get("sphinx_rss_delta"),
+        )
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    config = session.config
+    if (
+        config.getoption("sphinx_watch")
+        and not config.getoption("collectonly")
+        and not hasattr(config, "workerinput")
+    ):
+        config.stash[_WATCHER_KEY] = _Watcher(session)
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: list[pytest.Item]
+) -> None:
+    if config.getoption("sphinx_check_only"):
+        deselected = [item for item in items if not isinstance(item, SphinxCheckItem)]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if isinstance(item, SphinxCheckItem)]
+    shard = config.getoption("sphinx_shard")
+    if shard is None:
+        return
+    index, count = shard
+    cache = getattr(config, "cache", None)
+    durations = cache.get(_DURATIONS_PATH, {}) if cache is not None else {}
+    doc_items = [item for item in items if isinstance(item, SphinxDoctestItem)]
+    selected = set(_select_shard(doc_items, durations, index - 1, count))
+    deselected = [item for item in doc_items if item not in selected]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [
+            item
+            for item in items
+            if not isinstance(item, SphinxDoctestItem) or item in selected
+        ]
+
+
+def _select_shard(
+    items: list[SphinxDoctestItem],
+    durations: dict[str, float],
+    index: int,
+    count: int,
+) -> list[SphinxDoctestItem]:
+    """Return the items of the `index`-th of `count` shards.
+
+    The items are assigned greedily, longest first, to the shard with the
+    smallest total duration.  The duration of items that weren't run before
+    is estimated from the size of their examples.
+    """
+
+    def size(item: SphinxDoctestItem) -> int:
+        return sum(len(ex.source) + len(ex.want) for ex in item.dtest.examples)
+
+    known = [item for item in items if item.nodeid in durations]
+    known_size = sum(size(item) for item in known)
+    seconds_per_char = 1.0
+    if known_size:
+        seconds_per_char = sum(durations[item.nodeid] for item in known) / known_size
+
+    def estimate(item: SphinxDoctestItem) -> float:
+        if item.nodeid in durations:
+            return durations[item.nodeid]
+        return size(item) * seconds_per_char
+
+    totals = [0.0] * count
+    shard_items: list[list[SphinxDoctestItem]] = [[] for _ in range(count)]
+    for duration, item in sorted(
+        ((estimate(item), item) for item in items),
+        key=lambda x: (-x[0], x[1].nodeid),
+    ):
+        shard = totals.index(min(totals))
+        totals[shard] += duration
+        shard_items[shard].append(item)
+    return shard_items[index]
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    config = session.config
+    result_cache = config.stash.get(_RESULT_CACHE_KEY, None)
+    if result_cache is not None:
+        result_cache.save()
+    durations = config.stash.get(_DURATIONS_KEY, None)
+    cache = getattr(config, "cache", None)
+    if durations and cache is not None:
+        # keep the durations of items that were not run, e.g. because they
+        # belong to another shard
+        cache.set(_DURATIONS_PATH, {**cache.get(_DURATIONS_PATH, {}), **durations})
+    stats = config.stash.get(_STATS_KEY, None)
+    stats_path = config.getoption("sphinx_stats_json")
+    if stats is not None and stats_path:
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(stats.as_dict(), f, indent=2)
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    fork_server = config.stash.get(_FORK_SERVER_KEY, None)
+    if fork_server is not None:
+        fork_server.stop()
+    global_setup = config.stash.get(_GLOBAL_SETUP_KEY, None)
+    if global_setup is not None and global_setup.cleanup:
+        exec(global_setup.cleanup, dict(global_setup.namespace))
+    runner = config.stash.get(_RUNNER_KEY, None)
+    if runner is not None:
+        runner.close_event_loop()
+        if runner.track_resources and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def pytest_terminal_summary(
+    terminalreporter: pytest.TerminalReporter, config: pytest.Config
+) -> None:
+    result_cache = config.stash.get(_RESULT_CACHE_KEY, None)
+    if result_cache is not None and result_cache.hits:
+        terminalreporter.write_line(
+            f"pytest-sphinx: {result_cache.hits} doc item(s) passed in a previous "
+            "run and were not executed (--sphinx-result-cache)"
+        )
+    resource_usage = config.stash.get(_RESOURCE_USAGE_KEY, None)
+    if resource_usage is not None and resource_usage.usage:
+        _write_resource_usage(terminalreporter, resource_usage.usage)
+    stats = config.stash.get(_STATS_KEY, None)
+    if stats is not None:
+        _write_stats(terminalreporter, stats)
+    watcher = config.stash.get(_WATCHER_KEY, None)
+    if watcher is not None:
+        # after the failures of the session have been shown
+        watcher.run()
+
+
+def _write_resource_usage(
+    terminalreporter: pytest.TerminalReporter,
+    resource_usage: dict[str, ResourceUsage],
+) -> None:
+    terminalreporter.write_sep("=", "sphinx doctest resource usage")
+    by_peak = sorted(
+        resource_usage.items(), key=lambda item: item[1].peak_memory, reverse=True
+    )
+    for nodeid, usage in by_peak[:10]:
+        line = f"{_format_size(usage.peak_memory)} peak memory"
+        if usage.rss_delta is not None:
+            line += f", {_format_size(usage.rss_delta)} peak RSS growth"
+        if usage.lineno is not None:
+            line += f" (worst example at line {usage.lineno})"
+        terminalreporter.write_line(f"{line}  {nodeid}")
+
+
+def _write_stats(
+    terminalreporter: pytest.TerminalReporter, stats: _CollectionStats
+) -> None:
+    terminalreporter.write_sep("=", "sphinx doctest collection stats")
+    total = sum(stats.timings.values())
+    for phase, seconds in stats.timings.items():
+        share = seconds / total if total else 0
+        terminalreporter.write_line(
+            f"{phase:<10} {seconds:8.3f}s {share:6.1%}  "
+            f"{_CollectionStats.PHASES[phase]}"
+        )
+    terminalreporter.write_line(
+        ", ".join(f"{count} {counter}" for counter, count in stats.counters.items())
+    )
+
+
 def pytest_collect_file(
     file_path: Path, parent: Session | Package
-) -> SphinxDoctestModule | SphinxDoctestTextfile | None:
+) -> (
+    SphinxDoctestModule
+    | SphinxDoctestStub
+    | SphinxDoctestTextfile
+    | SphinxCheckFile
+    | None
+):
+    collector_cls = _get_collector_cls(file_path, parent)
+    if collector_cls is None:
+        return None
+    if parent.config.getoption("sphinx_check_only"):
+        if collector_cls is SphinxDoctestExtensionModule:
+            # the docstrings are only known after the import
+            return None
+        return SphinxCheckFile.from_parent(parent, path=file_path)  # type: ignore
+    return collector_cls.from_parent(parent, path=file_path)  # type: ignore
+
+
+def _get_collector_cls(
+    file_path: Path, parent: Session | Package
+) -> type[SphinxDoctestModule | SphinxDoctestStub | SphinxDoctestTextfile] | None:
     config = parent.config
+    textfile_cls = (
+        SphinxDoctestNotebook if file_path.suffix == ".ipynb" else SphinxDoctestTextfile
+    )
+    if config.getini("sphinx_extension_modules") and (
+        file_path.resolve() in _get_extension_modules(config)
+    ):
+        return SphinxDoctestExtensionModule
     if file_path.suffix == ".py":
         if config.option.doctestmodules:
-            mod: SphinxDoctestModule | SphinxDoctestTextfile = (
-                SphinxDoctestModule.from_parent(parent, path=file_path)
-            )
-            return mod
-    elif file_path.suffix in (".txt", ".rst", ".md") and parent.session.isinitpath(
-        file_path
-    ):
+            return SphinxDoctestModule
+    elif file_path.suffix == ".pyi":
+        if config.option.doctestmodules:
+            return SphinxDoctestStub
+    elif file_path.suffix in (
+        ".txt",
+        ".rst",
+        ".md",
+        ".ipynb",
+    ) and parent.session.isinitpath(file_path):
         # file was explicitly provided on the command line
-        return SphinxDoctestTextfile.from_parent(parent, path=file_path)  # type: ignore
+        return textfile_cls
     else:
         # the option is defined by pytest (see doctest module)
         globs = config.getoption("doctestglob") or ["test*.txt"]
         assert isinstance(globs, list)
         for glob in globs:
             if file_path.match(path_pattern=glob):
-                return SphinxDoctestTextfile.from_parent(parent, path=file_path)  # type: ignore
+                return textfile_cls
     return None
 
 
@@ -94,29 +712,46 @@ GlobDict = dict[str, Any]
 # with ":options:".
 _OPTION_DIRECTIVE_RE = re.compile(r':options:\s*([^\n\'"]*)$')
 _OPTION_SKIPIF_RE = re.compile(r':skipif:\s*([^\n\'"]*)$')
+_OPTION_TIMEOUT_RE = re.compile(r':timeout:\s*([^\n\'"]*)$')
 
+# The directive and fence regexes only match whitespace within a line
+# ([^\S\n]), so that they can be matched against single lines and also be
+# searched for in a whole text (see `_BufferScanEngine`).
 _RST_DIRECTIVE_RE = re.compile(
     r"""
-    \s*\.\.\s
+    ^[^\S\n]*\.\.[^\S\n]
     (?P<directive>(testcode|testoutput|testsetup|testcleanup|doctest))
-    ::\s*
+    ::[^\S\n]*
     (?P<argument>([^\n'"]*))
     $
     """,
-    re.VERBOSE,
+    re.VERBOSE | re.MULTILINE,
 )
 
+#: Matches the names of all directives, in RST and in MyST syntax.  Text
+#: without a match is not scanned for directives.
+_DIRECTIVE_PREFILTER_RE = re.compile(
+    r"(?:test(?:code|output|setup|cleanup)|doctest)(?:::|})"
+)
 _MYST_DIRECTIVE_RE = re.compile(
     r"""
-    \s*```
+    ^[^\S\n]*(?P<fence>`{3,}|:{3,})
     {(?P<directive>(testcode|testoutput|testsetup|testcleanup|doctest))}
-    \s*
+    [^\S\n]*
     (?P<argument>([^\n'"]*))
     $
     """,
-    re.VERBOSE,
+    re.VERBOSE | re.MULTILINE,
+)
+
+# Any backtick or colon fence of MyST, e.g. "```python", "````" or ":::{note}".
+_MYST_FENCE_RE = re.compile(
+    r"^[^\S\n]*(?P<fence>`{3,}|:{3,})(?P<info>[^\n]*)$", re.MULTILINE
 )
 
+# MyST directives whose content is code, like the content of "```python"
+_MYST_CODE_DIRECTIVES = ("{code-block}", "{code}", "{sourcecode}")
+
 _SYNTAX_TO_DIRECTIVE_RE = {
     DirectiveSyntax.RST: _RST_DIRECTIVE_RE,
     DirectiveSyntax.MYST: _MYST_DIRECTIVE_RE,
@@ -126,34 +761,36 @@ _FILE_EXTENSION_TO_SYNTAX = {
     ".txt": DirectiveSyntax.RST,
     ".rst": DirectiveSyntax.RST,
     ".md": DirectiveSyntax.MYST,
+    ".ipynb": DirectiveSyntax.MYST,
     ".py": DirectiveSyntax.RST,
 }
 
 
 def _split_into_body_and_options(
     section_content: str,
-) -> tuple[str, str | None, dict[int, bool]]:
+) -> tuple[str, str | None, dict[int, bool], float | None]:
     """Parse the the full content of a directive and split it.
 
-    It is split into a string, where the options (:options:, :hide: and
-    :skipif:) are removed, and into options.
+    It is split into a string, where the options (:options:, :hide:,
+    :skipif: and :timeout:) are removed, and into options.
 
     If there are options in `section_content`, they have to appear at the
-    very beginning. The first line that is not an option (:options:, :hide:
-    and :skipif:) and not a newline is the first line of the string that is
-    returned (`remaining`).
+    very beginning. The first line that is not an option (:options:, :hide:,
+    :skipif: and :timeout:) and not a newline is the first line of the string
+    that is returned (`remaining`).
 
     Parameters
     ----------
     section_content : str
-        String consisting of optional options (:skipif:, :hide:
-        or :options:), and of a body.
+        String consisting of optional options (:skipif:, :hide:,
+        :timeout: or :options:), and of a body.
 
     Returns
     -------
     body : str
     skipif_expr : str or None
     flag_settings : dict
+    timeout : float or None
 
     Raises
     ------
@@ -161,12 +798,14 @@ def _split_into_body_and_options(
         * If options and the body of the section are not
         separated by a newline.
         * If the body of the section is empty.
+        * If the timeout is not a positive number.
 
     """
     lines = section_content.strip().splitlines()
 
     skipif_expr = None
     flag_settings = {}
+    timeout = None
     i = 0
     for line in lines:
         stripped = line.strip()
@@ -175,6 +814,18 @@ def _split_into_body_and_options(
             assert skipif_match is not None
             skipif_expr = skipif_match.group(1)
             i += 1
+        elif _OPTION_TIMEOUT_RE.match(stripped):
+            timeout_match = _OPTION_TIMEOUT_RE.match(stripped)
+            assert timeout_match is not None
+            try:
+                timeout = float(timeout_match.group(1))
+            except ValueError:
+                timeout = None
+            if timeout is None or timeout <= 0:
+                raise ValueError(
+                    f"doctest has an invalid timeout {timeout_match.group(1)!r}"
+                )
+            i += 1
         elif _OPTION_DIRECTIVE_RE.match(stripped):
             directive_match = _OPTION_DIRECTIVE_RE.match(stripped)
             assert directive_match is not None
@@ -204,7 +855,7 @@ def _split_into_body_and_options(
         # no newline between option block and body
         raise ValueError(f"invalid option block: {section_content!r}")
 
-    return body, skipif_expr, flag_settings
+    return body, skipif_expr, flag_settings, timeout
 
 
 def _get_next_textoutputsections(
@@ -222,6 +873,28 @@ def _get_next_textoutputsections(
 SectionGroups = list[str] | None
 
 
+class DirectiveError(ValueError):
+    """A malformed doctest directive.
+
+    `lineno` is the (0-based) line of the directive in the parsed docstring.
+    """
+
+    def __init__(self, message: str, lineno: int) -> None:
+        super().__init__(message)
+        self.message = message
+        self.lineno = lineno
+
+
+def _add_directive_error(
+    errors: list[DirectiveError] | None, message: str, lineno: int
+) -> None:
+    """Append a `DirectiveError` to `errors`, or raise it if `errors` is None."""
+    error = DirectiveError(message, lineno)
+    if errors is None:
+        raise error
+    errors.append(error)
+
+
 class Section:
     def __init__(
         self,
@@ -229,24 +902,132 @@ class Section:
         content: str,
         lineno: int,
         groups: SectionGroups = None,
+        directive_lineno: int | None = None,
     ) -> None:
         super().__init__()
         self.directive = directive
         self.groups = groups
         self.lineno = lineno
-        body, skipif_expr, options = _split_into_body_and_options(content)
+        self.directive_lineno = directive_lineno
+        body, skipif_expr, options, timeout = _split_into_body_and_options(content)
 
         if skipif_expr and self.directive not in _DIRECTIVES_W_SKIPIF:
             raise ValueError(f":skipif: not allowed in {self.directive}")
         if options and self.directive not in _DIRECTIVES_W_OPTIONS:
             raise ValueError(f":options: not allowed in {self.directive}")
+        if timeout and self.directive not in _DIRECTIVES_W_TIMEOUT:
+            raise ValueError(f":timeout: not allowed in {self.directive}")
         self.body = body
         self.skipif_expr = skipif_expr
         self.options = options
+        self.timeout = timeout
 
 
-def get_sections(docstring: str, syntax: DirectiveSyntax) -> list[Any | Section]:
-    lines = textwrap.dedent(docstring).splitlines()
+class SphinxExample(doctest.Example):
+    """A `doctest.Example` created from a testcode directive.
+
+    In addition to the attributes of `doctest.Example` it remembers the groups
+    and the timeout of the testcode directive.  `source_lineno` is the line
+    in the file that is reported for the example (see `_set_source_linenos`),
+    which is None if the line of the docstring is unknown.
+    """
+
+    source_lineno: int | None = None
+    #: whether the example (or its output) was skipped by a :skipif: option
+    skipif = False
+    #: key of the included fragment the example belongs to, see
+    #: `_mark_fragments`
+    fragment: str | None = None
+
+    def __init__(
+        self,
+        *args: Any,
+        groups: SectionGroups = None,
+        timeout: float | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.groups = groups
+        self.timeout = timeout
+
+
+class _LineScanEngine:
+    """Find the lines matching a directive regex by matching every line.
+
+    This is the default engine, see the ``sphinx_scan_engine`` ini-option.
+    """
+
+    def scan(
+        self, regex: re.Pattern[str], lines: list[str]
+    ) -> Iterator[tuple[int, re.Match[str]]]:
+        """Yield the (0-based) number and the match of every matching line."""
+        for lineno, line in enumerate(lines):
+            match = regex.match(line)
+            if match is not None:
+                yield lineno, match
+
+
+class _BufferScanEngine(_LineScanEngine):
+    """Find the lines matching a directive regex with a single `finditer`.
+
+    The lines are joined and searched in one pass of the regex engine, so the
+    lines without a match are never visited in python.  The regex has to be
+    anchored with ``^`` and must not match newlines.
+    """
+
+    def scan(
+        self, regex: re.Pattern[str], lines: list[str]
+    ) -> Iterator[tuple[int, re.Match[str]]]:
+        text = "\n" + "\n".join(lines)
+        lineno = pos = 0
+        for match in _get_buffer_regex(regex).finditer(text):
+            lineno += text.count("\n", pos, match.start())
+            pos = match.start()
+            yield lineno, match
+
+
+@functools.cache
+def _get_buffer_regex(regex: re.Pattern[str]) -> re.Pattern[str]:
+    """Replace the ``^`` at the beginning of `regex` by a newline.
+
+    Unlike ``^`` (MULTILINE), a literal newline lets the regex engine skip to
+    the candidates quickly, which makes the search several times faster.
+    """
+    pattern = regex.pattern.lstrip() if regex.flags & re.VERBOSE else regex.pattern
+    if not pattern.startswith("^"):
+        raise ValueError(f"{regex.pattern!r} is not anchored with ^")
+    return re.compile(r"\n" + pattern[1:], regex.flags)
+
+
+_SCAN_ENGINES = {"line": _LineScanEngine(), "buffer": _BufferScanEngine()}
+
+_UNINDENTED_LINE_RE = re.compile(r"^\S", re.MULTILINE)
+
+
+def get_sections(
+    docstring: str,
+    syntax: DirectiveSyntax,
+    errors: list[DirectiveError] | None = None,
+    engine: _LineScanEngine | None = None,
+) -> list[Any | Section]:
+    """Find the sphinx doctest directives in the docstring.
+
+    A malformed directive raises a `DirectiveError`, unless a list `errors`
+    is given: then the errors of all malformed directives are appended to it
+    and the directives are left out.  `engine` finds the lines with
+    directives (default: `_LineScanEngine`).
+    """
+    if not _DIRECTIVE_PREFILTER_RE.search(docstring):
+        return []
+    if engine is None:
+        engine = _SCAN_ENGINES["line"]
+    if not _UNINDENTED_LINE_RE.search(docstring):
+        # dedenting is slow for long texts and a no-op if a line isn't
+        # indented (the bodies of the sections are dedented anyway)
+        docstring = textwrap.dedent(docstring)
+    lines = docstring.splitlines()
+    if syntax is DirectiveSyntax.MYST:
+        return _get_myst_sections(lines, errors, engine)
     sections = []
 
     def _get_indentation(line: str) -> int:
@@ -255,65 +1036,188 @@ def get_sections(docstring: str, syntax: DirectiveSyntax) -> list[Any | Section]
     def add_match(
         directive: SphinxDoctestDirectives, i: int, j: int, groups: SectionGroups
     ) -> None:
-        sections.append(
-            Section(
+        try:
+            section = Section(
                 directive,
                 textwrap.dedent("\n".join(lines[i + 1 : j])),
                 lineno=j - 1,
                 groups=groups,
+                directive_lineno=i,
             )
-        )
+        except ValueError as e:
+            _add_directive_error(errors, str(e), i)
+        else:
+            sections.append(section)
+
+    # the first line after the block of the previous directive
+    end = 0
+    for i, match in engine.scan(_SYNTAX_TO_DIRECTIVE_RE[syntax], lines):
+        if i < end:
+            continue
+        directive, groups = _get_directive_and_groups(match)
+        indentation = _get_indentation(lines[i])
+        # find the end of the block
+        end = i + 1
+        while end < len(lines) and not (
+            lines[end].lstrip() and _get_indentation(lines[end]) <= indentation
+        ):
+            end += 1
+        add_match(directive, i, end, groups)
+    return sections
 
-    i = 0
-    while True:
-        try:
-            line = lines[i]
-        except IndexError:
-            break
 
-        match = _SYNTAX_TO_DIRECTIVE_RE[syntax].match(line)
+def _get_directive_and_groups(
+    match: re.Match[str],
+) -> tuple[SphinxDoctestDirectives, SectionGroups]:
+    group = match.groupdict()
+    directive = getattr(SphinxDoctestDirectives, group["directive"].upper())
+    groups = [x.strip() for x in (group["argument"] or "default").split(",")]
+    return directive, groups
+
+
+def _is_closing_fence(line: str, fence: str) -> bool:
+    """Check if `line` closes a MyST block that was opened with `fence`."""
+    stripped = line.strip()
+    return len(stripped) >= len(fence) and stripped == fence[0] * len(stripped)
+
+
+def _get_myst_sections(
+    lines: list[str],
+    errors: list[DirectiveError] | None = None,
+    engine: _LineScanEngine | None = None,
+) -> list[Section]:
+    """Find the sphinx doctest directives in the lines of a MyST document.
+
+    The fences are scanned once by `engine`.  A block is closed by a fence of the same
+    character (backtick or colon) that is at least as long as its opening
+    fence, so blocks may contain shorter fences.  Code blocks (including
+    ``{code-block}`` and its aliases) are skipped, while the content of other
+    directives (e.g. ``:::{note}``) is markdown,
+    which may contain doctest directives.
+    """
+    if engine is None:
+        engine = _SCAN_ENGINES["line"]
+    sections = []
+    # fences of the enclosing directives that are not doctest directives
+    open_fences: list[str] = []
+    fences = engine.scan(_MYST_FENCE_RE, lines)
+    for i, fence_match in fences:
+        fence = fence_match.group("fence")
+        info = fence_match.group("info").strip()
+        if not info and open_fences and _is_closing_fence(lines[i], open_fences[-1]):
+            open_fences.pop()
+            continue
+        match = _MYST_DIRECTIVE_RE.match(lines[i])
+        if (
+            match is None
+            and info.startswith("{")
+            and info.split(maxsplit=1)[0] not in _MYST_CODE_DIRECTIVES
+        ):
+            open_fences.append(fence)
+            continue
+
+        # find the end of the doctest directive or of the code block, which
+        # is a fence as well
+        j = next(
+            (j for j, _ in fences if _is_closing_fence(lines[j], fence)), len(lines)
+        )
         if match:
-            group = match.groupdict()
-            directive = getattr(SphinxDoctestDirectives, group["directive"].upper())
-            groups = [x.strip() for x in (group["argument"] or "default").split(",")]
-            indentation = _get_indentation(line)
-            # find the end of the block
-            j = i
-            while True:
-                j += 1
-                try:
-                    block_line = lines[j]
-                except IndexError:
-                    add_match(directive, i, j, groups)
-                    break
-                if (
-                    syntax is DirectiveSyntax.RST
-                    and block_line.lstrip()
-                    and _get_indentation(block_line) <= indentation
-                ) or (syntax is DirectiveSyntax.MYST and block_line.lstrip() == "```"):
-                    add_match(directive, i, j, groups)
-                    i = j - 1
-                    break
-        i += 1
+            directive, groups = _get_directive_and_groups(match)
+            content = textwrap.dedent("\n".join(lines[i + 1 : j])).splitlines()
+            try:
+                section = Section(
+                    directive,
+                    "\n".join(_convert_myst_option_block(content)),
+                    lineno=j - 1,
+                    groups=groups,
+                    directive_lineno=i,
+                )
+            except ValueError as e:
+                _add_directive_error(errors, str(e), i)
+            else:
+                sections.append(section)
     return sections
 
 
+def _convert_myst_option_block(content: list[str]) -> list[str]:
+    """Convert a YAML option block of a MyST directive into field options.
+
+    E.g. the lines ``---``, ``options: +ELLIPSIS``, ``---`` at the beginning
+    of `content` are replaced by ``:options: +ELLIPSIS`` and an empty line.
+    Only flat ``key: value`` pairs are supported.
+    """
+    if not content or content[0].strip() != "---":
+        return content
+    try:
+        end = next(i for i, line in enumerate(content[1:], 1) if line.strip() == "---")
+    except StopIteration:
+        return content
+    fields = []
+    for line in content[1:end]:
+        if not line.strip():
+            continue
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "hide":
+            # the value doesn't matter, :hide: is ignored anyway
+            fields.append(":hide:")
+            continue
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        fields.append(f":{key}: {value}".rstrip())
+    return [*fields, "", *content[end + 1 :]]
+
+
 def docstring2examples(
     docstring: str,
     syntax: DirectiveSyntax = DirectiveSyntax.RST,
     globs: GlobDict | None = None,
-) -> list[Any | doctest.Example]:
+    errors: list[DirectiveError] | None = None,
+) -> list[Any | SphinxExample]:
     """Parse all sphinx test directives in the docstring.
 
-    This function also creates a list of examples that are returned.
+    This function also creates a list of examples that are returned.  If a
+    list `errors` is given, malformed directives don't raise a
+    `DirectiveError`, but are appended to it and left out (see
+    `get_sections`).
     """
     # TODO subclass doctest.DocTestParser instead?
+    return _sections2examples(get_sections(docstring, syntax, errors), globs, errors)
+
 
+def _collect_examples(
+    docstring: str,
+    syntax: DirectiveSyntax,
+    globs: GlobDict | None,
+    stats: _CollectionStats | None,
+    engine: _LineScanEngine | None = None,
+) -> tuple[list[SphinxExample], list[DirectiveError]]:
+    """Like `docstring2examples`, but record the collection statistics.
+
+    The directives are found with the scan `engine`, see `get_sections`.
+    Return the examples and the malformed directives.
+    """
+    errors: list[DirectiveError] = []
+    with _phase(stats, "scan"):
+        sections = get_sections(docstring, syntax, errors, engine)
+    with _phase(stats, "examples"):
+        examples = _sections2examples(sections, globs, errors)
+    if stats is not None:
+        stats.counters["docstrings"] += 1
+        stats.counters["sections"] += len(sections)
+        stats.counters["examples"] += len(examples)
+    return examples, errors
+
+
+def _sections2examples(
+    sections: list[Section],
+    globs: GlobDict | None = None,
+    errors: list[DirectiveError] | None = None,
+) -> list[Any | SphinxExample]:
+    """Create the examples of the sections of a docstring."""
     if globs is None:
         globs = {}
 
-    sections = get_sections(docstring, syntax)
-
     def get_testoutput_section_data(
         section: Section,
     ) -> tuple[str, dict[int, bool], int, Any | None]:
@@ -342,7 +1246,12 @@ def docstring2examples(
 
             num_unskipped_sections = len([d for d in section_data_seq if d[0]])
             if num_unskipped_sections > 1:
-                raise ValueError("There are multiple unskipped TESTOUTPUT sections")
+                _add_directive_error(
+                    errors,
+                    "There are multiple unskipped TESTOUTPUT sections",
+                    current_section.directive_lineno or 0,
+                )
+                continue
 
             if num_unskipped_sections:
                 want, options, _, exc_msg = next(d for d in section_data_seq if d[0])
@@ -352,27 +1261,285 @@ def docstring2examples(
                 # independent TESTCODE sections?
                 want, options, exc_msg = "", {}, None
 
-            if current_section.skipif_expr and eval(current_section.skipif_expr, globs):
-                # TODO add the doctest.Example to `examples` but mark it as
-                # skipped.
-                continue
-
-            examples.append(
-                doctest.Example(
-                    source=current_section.body,
-                    want=want,
-                    exc_msg=exc_msg,
-                    # we want to see the ..testcode lines in the
-                    # console output but not the ..testoutput
-                    # lines
-                    # TODO why do we want to hide testoutput??
-                    lineno=current_section.lineno,
-                    options=options,
-                )
+            skipped = bool(
+                current_section.skipif_expr and eval(current_section.skipif_expr, globs)
+            )
+            if skipped:
+                # keep the example, so that it is counted as skipped
+                options = {**options, doctest.SKIP: True}
+
+            example = SphinxExample(
+                source=current_section.body,
+                want=want,
+                exc_msg=exc_msg,
+                # we want to see the ..testcode lines in the
+                # console output but not the ..testoutput
+                # lines
+                # TODO why do we want to hide testoutput??
+                lineno=current_section.lineno,
+                options=options,
+                groups=current_section.groups,
+                timeout=current_section.timeout,
             )
+            example.skipif = skipped or num_unskipped_sections < len(section_data_seq)
+            examples.append(example)
     return examples
 
 
+class ExampleTimeout(BaseException):
+    """Raised in an example that runs longer than its timeout.
+
+    Like `KeyboardInterrupt` it is not an `Exception`, so that the
+    ``except Exception:`` of a retry or poll loop in the example doesn't
+    swallow it.
+    """
+
+
+@contextlib.contextmanager
+def _timeout(seconds: float, location: str) -> Iterator[None]:
+    """Raise `ExampleTimeout` in the block if it takes longer than `seconds`.
+
+    The timeout is implemented with SIGALRM and is therefore only enforced in
+    the main thread on platforms that support `signal.setitimer`, otherwise
+    a warning is issued.  A timer that is already armed (e.g. the one of
+    pytest-timeout) is kept: if it expires first, the timeout isn't armed,
+    and otherwise it is re-armed with its remaining time afterwards.
+    """
+    reason = None
+    if not hasattr(signal, "setitimer"):
+        reason = "signal.setitimer is not available"
+    elif threading.current_thread() is not threading.main_thread():
+        reason = "the example doesn't run in the main thread (--sphinx-group-workers)"
+    if reason is not None:
+        warnings.warn(
+            pytest.PytestWarning(
+                f"the timeout of {seconds}s of the example at {location} cannot "
+                f"be enforced: {reason}"
+            ),
+            stacklevel=1,
+        )
+        yield
+        return
+
+    outer_delay, outer_interval = signal.getitimer(signal.ITIMER_REAL)
+    if outer_delay and outer_delay <= seconds:
+        # the outer timer expires first, its handler takes care of it
+        yield
+        return
+
+    def handler(signum: int, frame: Any) -> None:
+        raise ExampleTimeout(f"example exceeded the timeout of {seconds}s ({location})")
+
+    previous_handler = signal.signal(signal.SIGALRM, handler)
+    start = time.monotonic()
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        if outer_delay:
+            # a timer delay of 0 would disarm it, so let it expire right away
+            remaining = max(outer_delay - (time.monotonic() - start), 1e-6)
+            signal.setitimer(signal.ITIMER_REAL, remaining, outer_interval)
+
+
+class ResourceUsage(NamedTuple):
+    """Memory used by an example or by a whole doctest.
+
+    `peak_memory` is the peak of the memory traced by `tracemalloc` in bytes,
+    relative to the traced memory at the start.  `rss_delta` is the growth
+    of the peak resident set size in bytes, or None if it cannot be measured.
+    `lineno` is the line number of the (worst) example.
+    """
+
+    lineno: int | None
+    peak_memory: int
+    rss_delta: int | None
+
+
+class ExampleRecord(NamedTuple):
+    """The outcome of a single example, see ``--sphinx-example-records``.
+
+    `outcome` is one of "passed", "failed", "error" (unexpected exception)
+    and "skipped".  `skipif` is True if the output of the example (or the
+    example itself) was skipped by a ``:skipif:`` option.  `duration` is the
+    run time in seconds.
+    """
+
+    lineno: int | None
+    groups: list[str] | None
+    outcome: str
+    duration: float
+    skipif: bool
+
+
+def _max_rss() -> int | None:
+    """Return the peak resident set size of the process in bytes."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def _parse_size(size: str) -> int:
+    """Convert a size like "512M" into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", size, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"invalid size {size!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def _format_size(size: int) -> str:
+    unit = "B"
+    for larger_unit in ("KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            break
+        size //= 1024
+        unit = larger_unit
+    return f"{size} {unit}"
+
+
+class _ThreadLocalOut:
+    """Stand-in for `sys.stdout` that writes to a buffer of the current thread.
+
+    Output of threads without a buffer goes to `fallback`.
+    """
+
+    def __init__(self, local: threading.local, fallback: Any) -> None:
+        self._local = local
+        self._fallback = fallback
+
+    def write(self, s: str) -> int:
+        out = getattr(self._local, "out", self._fallback)
+        return out.write(s)  # type:ignore[no-any-return]
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._fallback, name)
+
+
+class _EarlyMismatch(BaseException):
+    """Raised when the output of a running example cannot match anymore.
+
+    Derived from `BaseException`, so that it isn't swallowed by an
+    ``except Exception`` of the example.
+    """
+
+
+#: Option flags, with which a prefix of the output can be compared to the
+#: expected output.  Other flags (e.g. NUMBER of pytest) rewrite the outputs.
+_EARLY_MISMATCH_FLAGS = doctest.COMPARISON_FLAGS | doctest.REPORTING_FLAGS
+
+
+class _OutputPrefixCheck:
+    """Compare the output of an example to its expected output while it runs.
+
+    `feed` returns False as soon as the output written so far cannot be the
+    prefix of an output that the output checker accepts.  Without
+    NORMALIZE_WHITESPACE the output is compared line by line (whitespace-only
+    lines match empty lines, like in `doctest.OutputChecker`), and the last
+    line is only compared once it is complete.  With ELLIPSIS only the part
+    of the expected output before the first "..." is compared.
+    """
+
+    def __init__(self, want: str, optionflags: int) -> None:
+        if not optionflags & doctest.DONT_ACCEPT_BLANKLINE:
+            want = re.sub(rf"(?m)^{re.escape(doctest.BLANKLINE_MARKER)}\s*?$", "", want)
+        #: whether the output may be longer than `want`
+        self._open = False
+        if optionflags & doctest.ELLIPSIS and doctest.ELLIPSIS_MARKER in want:
+            want = want.split(doctest.ELLIPSIS_MARKER, 1)[0]
+            self._open = True
+        self._normalize = bool(optionflags & doctest.NORMALIZE_WHITESPACE)
+        self._done = False
+        if self._normalize:
+            self._want = " ".join(want.split())
+            self._pos = 0
+            self._pending_space = False
+        else:
+            *self._want_lines, self._want_tail = want.split("\n")
+            self._lineno = 0
+            self._line = ""
+
+    @classmethod
+    def create(
+        cls, example: doctest.Example, optionflags: int
+    ) -> _OutputPrefixCheck | None:
+        """Return a check for `example`, or None if it cannot be done early."""
+        if (
+            example.exc_msg is not None
+            or optionflags & ~_EARLY_MISMATCH_FLAGS
+            # "True" is accepted for "1" and "False" for "0"
+            or example.want in ("1\n", "0\n")
+        ):
+            return None
+        return cls(example.want, optionflags)
+
+    def feed(self, s: str) -> bool:
+        """Add `s` to the output, return False if it cannot match anymore."""
+        if self._done:
+            return True
+        if self._normalize:
+            return self._feed_normalized(s)
+        *lines, self._line = (self._line + s).split("\n")
+        for line in lines:
+            got = line if line.strip() else ""
+            if self._lineno < len(self._want_lines):
+                if got != self._want_lines[self._lineno]:
+                    return False
+                self._lineno += 1
+            elif self._open and got.startswith(self._want_tail):
+                # the rest is matched by the ellipsis
+                self._done = True
+                return True
+            else:
+                return False
+        return True
+
+    def _feed_normalized(self, s: str) -> bool:
+        parts = []
+        for match in re.finditer(r"\S+", s):
+            separated = match.start() > 0 or self._pending_space
+            if separated and (self._pos or parts):
+                parts.append(" ")
+            parts.append(match.group())
+            self._pending_space = False
+        if s:
+            self._pending_space = s[-1].isspace()
+        normalized = "".join(parts)
+        end = self._pos + len(normalized)
+        if end > len(self._want):
+            if not self._open:
+                return False
+            self._done = True
+            return normalized.startswith(self._want[self._pos :])
+        if self._want[self._pos : end] != normalized:
+            return False
+        self._pos = end
+        return True
+
+
+class _CheckedOut(doctest._SpoofOut):  # type:ignore
+    """Output buffer that raises `_EarlyMismatch` when `check` fails."""
+
+    check: _OutputPrefixCheck | None = None
+
+    def write(self, s: str) -> int:
+        n = super().write(s)
+        if self.check is not None and not self.check.feed(s):
+            self.check = None
+            raise _EarlyMismatch
+        return n  # type:ignore[no-any-return]
+
+
+#: The output, the exception info and the duration of an example.
+ExampleResult = tuple[str, Any, float]
+
+
 class SphinxDocTestRunner(doctest.DebugRunner):
     """Overwrite `doctest.DocTestRunner.__run`.
 
@@ -383,6 +1550,351 @@ class SphinxDocTestRunner(doctest.DebugRunner):
     _fakeout: _SpoofOut
     debugger: pdb.Pdb
 
+    #: Either "doctest" or "session", see the ``sphinx_event_loop_scope``
+    #: ini-option.
+    event_loop_scope = "doctest"
+    _event_loop: asyncio.AbstractEventLoop | None = None
+
+    #: Number of threads used for running distinct groups of a doctest
+    #: concurrently, see the ``--sphinx-group-workers`` option.  Groups are
+    #: run serially if this is less than 2.
+    group_workers = 0
+
+    #: Default timeout in seconds of an example, see the ``sphinx_timeout``
+    #: ini-option.  Examples run without a timeout if it is None.
+    timeout: float | None = None
+
+    #: Whether the memory usage of every example is measured, see the
+    #: ``--sphinx-resource-usage`` option.  The measurements of the last run
+    #: are stored in `example_resource_usage` and `resource_usage`.
+    track_resources = False
+    example_resource_usage: list[ResourceUsage]
+    resource_usage: ResourceUsage | None = None
+
+    #: Maximum number of characters of the expected and of the actual output
+    #: in a failure report, see the ``sphinx_report_max_size`` ini-option.
+    #: Larger outputs are truncated and written in full to a file in
+    #: `spill_dir` (or in a temporary directory if it is None), which keeps
+    #: the reports small, e.g. when they are sent from pytest-xdist workers.
+    report_max_size: int | None = None
+    spill_dir: Path | None = None
+    #: The node ID of the item being run, which makes the names of its spill
+    #: files unique (the name of a text file doctest is just its basename).
+    nodeid: str | None = None
+
+    #: How often the fragments (see `_mark_fragments`) occur in the collected
+    #: doctests, see the ``sphinx_dedup_includes`` ini-option.  The names
+    #: bound (or rebound) by a passing fragment that occurs more than once
+    #: are stored in `_fragment_namespaces`, and the fragment is not run again
+    #: in the same context.
+    fragment_counts: collections.Counter[str]
+    _fragment_namespaces: dict[str, dict[str, Any]]
+
+    #: Whether an example is aborted as soon as its output cannot match the
+    #: expected output anymore, see the ``--sphinx-early-mismatch`` option
+    #: and `_OutputPrefixCheck`.
+    early_mismatch = False
+
+    #: Whether the outcome of every example of the last run is stored in
+    #: `example_records`, see the ``--sphinx-example-records`` option.
+    record_examples = False
+    example_records: list[ExampleRecord]
+
+    #: Whether a (shallow) copy of the globals before every example of the
+    #: last run is stored in `snapshots`, see the ``--sphinx-watch`` option.
+    #: The copies are only taken if the examples are run serially.
+    keep_snapshots = False
+    snapshots: list[dict[str, Any]]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._fakeout = _CheckedOut()
+        self.fragment_counts = collections.Counter()
+        self._fragment_namespaces = {}
+
+    def run(
+        self,
+        test: doctest.DocTest,
+        compileflags: int | None = None,
+        out: _Out | None = None,
+        clear_globs: bool = True,
+    ) -> doctest.TestResults:
+        # a single runner is shared by all items of a session (see
+        # `_get_runner`), so drop whatever the previous item left behind.
+        self._reset()
+        # `DebugRunner.report_failure` raises before the option flags of the
+        # failing example are restored, so restore them here.
+        optionflags = self.optionflags
+        if self.track_resources:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            start_rss = _max_rss()
+        try:
+            return super().run(test, compileflags, out, clear_globs)
+        finally:
+            self.optionflags = optionflags
+            if self.event_loop_scope == "doctest":
+                self.close_event_loop()
+            if self.track_resources:
+                self.resource_usage = self._total_resource_usage(
+                    start_memory, start_rss
+                )
+
+    def _total_resource_usage(
+        self, start_memory: int, start_rss: int | None
+    ) -> ResourceUsage:
+        # the peak of the doctest is the highest peak of its examples, whose
+        # peaks are measured relative to the traced memory at their start.
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        for usage, example_start in zip(
+            self.example_resource_usage, self._example_start_memory, strict=True
+        ):
+            peak_memory = max(peak_memory, example_start + usage.peak_memory)
+        lineno = None
+        if self.example_resource_usage:
+            worst = max(self.example_resource_usage, key=lambda u: u.peak_memory)
+            lineno = worst.lineno
+        end_rss = _max_rss()
+        rss_delta = None
+        if start_rss is not None and end_rss is not None:
+            rss_delta = end_rss - start_rss
+        return ResourceUsage(lineno, peak_memory - start_memory, rss_delta)
+
+    def _reset(self) -> None:
+        """Forget the outcomes and the output of previously run doctests."""
+        self.tries = self.failures = 0
+        if sys.version_info >= (3, 13):
+            self.skips = 0
+            self._stats = {}  # type:ignore
+        else:
+            self._name2ft = {}  # type:ignore
+        self._fakeout.truncate(0)
+        self.example_resource_usage = []
+        self._example_start_memory: list[int] = []
+        self.resource_usage = None
+        self.example_records = []
+        self.snapshots = []
+
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        if self._event_loop is None:
+            self._event_loop = asyncio.new_event_loop()
+        return self._event_loop
+
+    def close_event_loop(self) -> None:
+        """Close the event loop that runs examples with top-level await."""
+        loop, self._event_loop = self._event_loop, None
+        if loop is not None:
+            try:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                loop.close()
+
+    def _merge_optionflags(self, example: doctest.Example, optionflags: int) -> int:
+        """Return `optionflags` updated with the options of `example`."""
+        if example.options:
+            for optionflag, val in example.options.items():
+                if val:
+                    optionflags |= optionflag
+                else:
+                    optionflags &= ~optionflag
+        return optionflags
+
+    def _exec_example(
+        self,
+        test: doctest.DocTest,
+        examplenum: int,
+        compileflags: int,
+        globs: GlobDict,
+        get_event_loop: Callable[[], asyncio.AbstractEventLoop],
+    ) -> None:
+        example = test.examples[examplenum]
+        # Use a special filename for compile(), so we can retrieve
+        # the source code during interactive debugging (see
+        # __patched_linecache_getlines).
+        filename = f"<doctest {test.name}[{examplenum}]>"
+        timeout = getattr(example, "timeout", None) or self.timeout
+        if timeout:
+            location = test.filename
+            source_lineno = getattr(example, "source_lineno", None)
+            if source_lineno is not None:
+                location = f"{location}:{source_lineno}"
+            with _timeout(timeout, location):
+                self._exec_code(example, filename, compileflags, globs, get_event_loop)
+        else:
+            self._exec_code(example, filename, compileflags, globs, get_event_loop)
+
+    def _exec_code(
+        self,
+        example: doctest.Example,
+        filename: str,
+        compileflags: int,
+        globs: GlobDict,
+        get_event_loop: Callable[[], asyncio.AbstractEventLoop],
+    ) -> None:
+        code = compile(
+            example.source,
+            filename,
+            "exec",
+            compileflags | ast.PyCF_ALLOW_TOP_LEVEL_AWAIT,
+            1,
+        )
+        if code.co_flags & inspect.CO_COROUTINE:
+            # the example uses top-level await; all such examples of
+            # a doctest (or a session) share one event loop.
+            get_event_loop().run_until_complete(eval(code, globs))
+        else:
+            exec(code, globs)
+
+    def _run_groups_concurrently(
+        self, test: doctest.DocTest, compileflags: int
+    ) -> dict[int, ExampleResult] | None:
+        """Run the distinct groups of `test` in a thread pool.
+
+        Every group gets its own copy of `test.globs`, its own output buffer
+        and its own event loop.  Return the output and the exception info of
+        every example that was not skipped, indexed by its position in
+        `test.examples`, or None if the examples cannot be split into
+        independent groups.
+        """
+        partitions: dict[str, list[int]] = {}
+        for examplenum, example in enumerate(test.examples):
+            groups = getattr(example, "groups", None) or ["default"]
+            if len(groups) != 1 or groups[0] == "*":
+                return None
+            partitions.setdefault(groups[0], []).append(examplenum)
+        if len(partitions) < 2:
+            return None
+
+        local = threading.local()
+
+        def run_group(examplenums: list[int]) -> dict[int, ExampleResult]:
+            globs = dict(test.globs)
+            out = local.out = doctest._SpoofOut()  # type:ignore
+            loop: asyncio.AbstractEventLoop | None = None
+
+            def get_event_loop() -> asyncio.AbstractEventLoop:
+                nonlocal loop
+                if loop is None:
+                    loop = asyncio.new_event_loop()
+                return loop
+
+            results = {}
+            try:
+                for examplenum in examplenums:
+                    example = test.examples[examplenum]
+                    if self._merge_optionflags(example, self.optionflags) & (
+                        doctest.SKIP
+                    ):
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        self._exec_example(
+                            test, examplenum, compileflags, globs, get_event_loop
+                        )
+                        exception = None
+                    except KeyboardInterrupt:
+                        raise
+                    except (Exception, ExampleTimeout):
+                        exception = sys.exc_info()
+                    duration = time.perf_counter() - start
+                    results[examplenum] = (out.getvalue(), exception, duration)
+                    out.truncate(0)
+            finally:
+                del local.out
+                if loop is not None:
+                    loop.close()
+            return results
+
+        results: dict[int, ExampleResult] = {}
+        save_stdout = sys.stdout
+        sys.stdout = _ThreadLocalOut(local, save_stdout)  # type:ignore
+        try:
+            with ThreadPoolExecutor(max_workers=self.group_workers) as pool:
+                for group_results in pool.map(run_group, partitions.values()):
+                    results.update(group_results)
+        finally:
+            sys.stdout = save_stdout
+        return results
+
+    def report_failure(
+        self, out: _Out, test: doctest.DocTest, example: doctest.Example, got: str
+    ) -> None:
+        if self.report_max_size and max(len(got), len(example.want)) > (
+            self.report_max_size
+        ):
+            example, got = self._spill_failure(test, example, got)
+        super().report_failure(out, test, example, got)
+
+    def _spill_failure(
+        self, test: doctest.DocTest, example: doctest.Example, got: str
+    ) -> tuple[doctest.Example, str]:
+        """Write the outputs of a failed example to a spill file.
+
+        Return a copy of the example and the actual output, which are
+        truncated to `report_max_size` characters and refer to the file.
+        """
+        assert self.report_max_size
+        if self.spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="pytest-sphinx-"))
+        name = re.sub(r"[^\w.-]", "_", test.name)
+        node_hash = hashlib.sha256(
+            (self.nodeid or str(test.filename)).encode()
+        ).hexdigest()[:8]
+        path = self.spill_dir / f"{name}-{node_hash}-{example.lineno}.txt"
+        path.write_text(
+            f"--- expected ({len(example.want)} characters)\n{example.want}\n"
+            f"--- got ({len(got)} characters)\n{got}",
+            encoding="utf-8",
+        )
+
+        def truncate(text: str) -> str:
+            assert self.report_max_size
+            if len(text) <= self.report_max_size:
+                return text
+            return (
+                f"{text[: self.report_max_size]}\n"
+                f"... [{len(text) - self.report_max_size} more characters, "
+                f"full output in {path}]\n"
+            )
+
+        example = copy.copy(example)
+        example.want = truncate(example.want)
+        return example, truncate(got)
+
+    def _record_example(
+        self, example: doctest.Example, outcome: str, duration: float
+    ) -> None:
+        if not self.record_examples:
+            return
+        self.example_records.append(
+            ExampleRecord(
+                getattr(example, "source_lineno", None),
+                getattr(example, "groups", None),
+                outcome,
+                duration,
+                getattr(example, "skipif", False),
+            )
+        )
+
+    def _record_example_resource_usage(
+        self,
+        test: doctest.DocTest,
+        example: doctest.Example,
+        start_memory: int,
+        start_rss: int | None,
+    ) -> None:
+        end_rss = _max_rss()
+        rss_delta = None
+        if start_rss is not None and end_rss is not None:
+            rss_delta = end_rss - start_rss
+        lineno = getattr(example, "source_lineno", None)
+        peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+        self.example_resource_usage.append(
+            ResourceUsage(lineno, peak_memory, rss_delta)
+        )
+        self._example_start_memory.append(start_memory)
+
     def _DocTestRunner__run(
         self, test: doctest.DocTest, compileflags: int, out: _Out
     ) -> doctest.TestResults:
@@ -408,8 +1920,41 @@ class SphinxDocTestRunner(doctest.DebugRunner):
 
         check = self._checker.check_output
 
+        # Distinct groups are run up-front, the outcomes are reported below.
+        precomputed = None
+        if self.group_workers > 1:
+            precomputed = self._run_groups_concurrently(test, compileflags)
+
+        # fragment of the current example, whose namespace is stored after
+        # its last example if it passed
+        fragment = None
+        fragment_failures = 0
+        # the globals before the fragment
+        fragment_globs: dict[str, Any] = {}
+
         # Process each example.
         for examplenum, example in enumerate(test.examples):
+            example_fragment = getattr(example, "fragment", None)
+            if example_fragment != fragment:
+                fragment = None
+                if (
+                    precomputed is None
+                    and not self.keep_snapshots
+                    and self.fragment_counts[example_fragment] > 1
+                ):
+                    fragment = example_fragment
+                    fragment_failures = failures
+                    if fragment in self._fragment_namespaces:
+                        # the fragment passed in the same context before
+                        test.globs.update(self._fragment_namespaces[fragment])
+                    else:
+                        fragment_globs = dict(test.globs)
+            if fragment is not None and fragment in self._fragment_namespaces:
+                tries += 1
+                continue
+            if self.keep_snapshots and precomputed is None:
+                self.snapshots.append(dict(test.globs))
+
             # If REPORT_ONLY_FIRST_FAILURE is set, then suppress
             # reporting after the first failure.
             quiet = (
@@ -417,17 +1962,12 @@ class SphinxDocTestRunner(doctest.DebugRunner):
             )
 
             # Merge in the example's options.
-            self.optionflags = original_optionflags
-            if example.options:
-                for optionflag, val in example.options.items():
-                    if val:
-                        self.optionflags |= optionflag
-                    else:
-                        self.optionflags &= ~optionflag
+            self.optionflags = self._merge_optionflags(example, original_optionflags)
 
             # If 'SKIP' is set, then skip this example.
             if self.optionflags & doctest.SKIP:
                 skips += 1
+                self._record_example(example, "skipped", 0.0)
                 continue
 
             # Record that we started this example.
@@ -435,35 +1975,59 @@ class SphinxDocTestRunner(doctest.DebugRunner):
             if not quiet:
                 self.report_start(out, test, example)
 
-            # Use a special filename for compile(), so we can retrieve
-            # the source code during interactive debugging (see
-            # __patched_linecache_getlines).
-            filename = f"<doctest {test.name}[{examplenum}]>"
+            mismatched = False
+            if precomputed is not None:
+                got, exception, duration = precomputed[examplenum]
+            else:
+                # Run the example in the given context (globs), and record
+                # any exception that gets raised.  (But don't intercept
+                # keyboard interrupts.)
+                if self.track_resources:
+                    tracemalloc.reset_peak()
+                    example_start_memory = tracemalloc.get_traced_memory()[0]
+                    example_start_rss = _max_rss()
+                if self.early_mismatch:
+                    self._fakeout.check = _OutputPrefixCheck.create(
+                        example, self.optionflags
+                    )
+                start = time.perf_counter()
+                try:
+                    # Don't blink!  This is where the user's code gets run.
+                    self._exec_example(
+                        test, examplenum, compileflags, test.globs, self._get_event_loop
+                    )
+                    self.debugger.set_continue()  # ==== Example Finished ====
+                    exception = None
+                except KeyboardInterrupt:
+                    raise
+                except _EarlyMismatch:
+                    # the output written so far doesn't match
+                    mismatched = True
+                    exception = None
+                    self.debugger.set_continue()  # ==== Example Finished ====
+                except (Exception, ExampleTimeout):
+                    exception = sys.exc_info()
+                    self.debugger.set_continue()  # ==== Example Finished ====
+                finally:
+                    self._fakeout.check = None
+                duration = time.perf_counter() - start
+                if self.track_resources:
+                    self._record_example_resource_usage(
+                        test, example, example_start_memory, example_start_rss
+                    )
 
-            # Run the example in the given context (globs), and record
-            # any exception that gets raised.  (But don't intercept
-            # keyboard interrupts.)
-            try:
-                # Don't blink!  This is where the user's code gets run.
-                exec(
-                    compile(example.source, filename, "exec", compileflags, 1),
-                    test.globs,
-                )
-                self.debugger.set_continue()  # ==== Example Finished ====
-                exception = None
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                exception = sys.exc_info()
-                self.debugger.set_continue()  # ==== Example Finished ====
+                got = self._fakeout.getvalue()  # the actual output
+                self._fakeout.truncate(0)
 
-            got = self._fakeout.getvalue()  # the actual output
-            self._fakeout.truncate(0)
             outcome = FAILURE  # guilty until proved innocent or insane
 
             # If the example executed without raising any exceptions,
             # verify its output.
-            if exception is None:
+            if mismatched:
+                if got and not got.endswith("\n"):
+                    got += "\n"
+                got += "[aborted: the output cannot match anymore]\n"
+            elif exception is None:
                 if check(example.want, got, self.optionflags):
                     outcome = SUCCESS
 
@@ -493,6 +2057,10 @@ class SphinxDocTestRunner(doctest.DebugRunner):
                     ):
                         outcome = SUCCESS
 
+            self._record_example(
+                example, ("passed", "failed", "error")[outcome], duration
+            )
+
             # Report the outcome.
             if outcome is SUCCESS:
                 if not quiet:
@@ -515,8 +2083,28 @@ class SphinxDocTestRunner(doctest.DebugRunner):
             else:
                 raise AssertionError(("unknown outcome", outcome))
 
+            if (
+                fragment is not None
+                and failures == fragment_failures
+                and (
+                    examplenum + 1 == len(test.examples)
+                    or getattr(test.examples[examplenum + 1], "fragment", None)
+                    != fragment
+                )
+            ):
+                # only the names bound by the fragment, the others (e.g.
+                # getfixture) belong to the item that ran it
+                self._fragment_namespaces[fragment] = {
+                    name: value
+                    for name, value in test.globs.items()
+                    if fragment_globs.get(name, fragment_globs) is not value
+                }
+
             if failures and self.optionflags & doctest.FAIL_FAST:
                 break
+            if exception is not None and exception[0] is ExampleTimeout:
+                # don't waste any more time on this doctest
+                break
 
         # Restore the option flags (in case they were modified)
         self.optionflags = original_optionflags
@@ -529,90 +2117,1834 @@ class SphinxDocTestRunner(doctest.DebugRunner):
         return doctest.TestResults(failures, tries)
 
 
-class SphinxDocTestParser:
-    def get_doctest(
-        self,
-        docstring: str,
-        globs: dict[str, Any],
-        name: str,
-        filename: str,
-        lineno: int,
-    ) -> doctest.DocTest:
-        # TODO document why we need to overwrite? get_doctest
-        return doctest.DocTest(
-            examples=docstring2examples(docstring, globs=globs),
-            globs=globs,
-            name=name,
-            filename=filename,
-            lineno=lineno,
-            docstring=docstring,
-        )
+_RUNNER_KEY = pytest.StashKey[SphinxDocTestRunner]()
+_RESOURCE_USAGE_KEY = pytest.StashKey["_ResourceUsageSummary"]()
+_MEMORY_LIMIT_KEY = pytest.StashKey["_MemoryLimit"]()
+_RESULT_CACHE_KEY = pytest.StashKey["_ResultCache"]()
+_DURATIONS_KEY = pytest.StashKey[dict[str, float]]()
+_DURATIONS_PATH = "sphinx/durations"
+_FORK_SERVER_KEY = pytest.StashKey["_ForkServer | None"]()
+_STATS_KEY = pytest.StashKey["_CollectionStats"]()
+_EXTENSION_MODULES_KEY = pytest.StashKey[dict[Path, str]]()
+_GLOBAL_SETUP_KEY = pytest.StashKey["_GlobalSetup"]()
+_WATCHER_KEY = pytest.StashKey["_Watcher"]()
 
 
-class SphinxDoctestTextfile(pytest.Module):
-    obj = None
+def _get_fork_server(session: pytest.Session) -> _ForkServer | None:
+    """Return the fork server of the session, starting it on first use.
+
+    Return None if the platform doesn't support fork.
+    """
+    config = session.config
+    if _FORK_SERVER_KEY not in config.stash:
+        fork_server = None
+        if hasattr(os, "fork"):
+            fork_server = _ForkServer(session)
+            fork_server.start()
+        else:
+            warnings.warn(
+                pytest.PytestWarning(
+                    "isolating doc items requires os.fork, they are run in-process"
+                ),
+                stacklevel=1,
+            )
+        config.stash[_FORK_SERVER_KEY] = fork_server
+    return config.stash[_FORK_SERVER_KEY]
+
+
+class _ForkServer:
+    """A forked copy of the pytest process that runs doc items in children.
+
+    The server is forked when the first isolated item is run, so the modules
+    imported during collection and the fixtures that were already set up
+    are shared (copy-on-write) with the children.  For every item the server
+    forks a child, which runs the whole test protocol of the item and sends
+    back the serialized reports.
+    """
+
+    def __init__(self, session: pytest.Session) -> None:
+        self.session = session
+        self.pid: int | None = None
+        self.conn: Connection | None = None
+
+    def start(self) -> None:
+        parent_conn, server_conn = Pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover - runs in the fork server
+            parent_conn.close()
+            try:
+                self._serve(server_conn)
+            finally:
+                os._exit(0)
+        server_conn.close()
+        self.pid = pid
+        self.conn = parent_conn
+
+    def stop(self) -> None:
+        if self.conn is not None and self.pid is not None:
+            self.conn.close()
+            os.waitpid(self.pid, 0)
+            self.conn = self.pid = None
+
+    def run(self, item: SphinxDoctestItem) -> list[pytest.TestReport]:
+        assert self.conn is not None
+        self.conn.send(item.nodeid)
+        result = self.conn.recv()
+        config = item.config
+        if isinstance(result, int):
+            return [
+                pytest.TestReport(
+                    item.nodeid,
+                    item.location,
+                    {name: 1 for name in item.keywords},
+                    "failed",
+                    f"doc item crashed the isolated process (exit status {result})",
+                    "call",
+                )
+            ]
+        return [
+            config.hook.pytest_report_from_serializable(config=config, data=data)
+            for data in result
+        ]
+
+    def _serve(self, conn: Connection) -> None:  # pragma: no cover - forked
+        items = {item.nodeid: item for item in self.session.items}
+        while True:
+            try:
+                nodeid = conn.recv()
+            except EOFError:
+                return
+            child_conn_recv, child_conn = Pipe(duplex=False)
+            pid = os.fork()
+            if pid == 0:
+                child_conn_recv.close()
+                conn.close()
+                try:
+                    child_conn.send(self._run_item(items[nodeid]))
+                finally:
+                    os._exit(0)
+            child_conn.close()
+            try:
+                result = child_conn_recv.recv()
+            except EOFError:
+                result = None
+            child_conn_recv.close()
+            _, status = os.waitpid(pid, 0)
+            conn.send(os.waitstatus_to_exitcode(status) if result is None else result)
+
+    def _run_item(self, item: pytest.Item) -> list[Any]:  # pragma: no cover
+        config = item.config
+        # tear down whatever the server inherited that item doesn't need
+        item.session._setupstate.teardown_exact(item)
+        reports = runtestprotocol(item, log=False, nextitem=None)
+        return [
+            config.hook.pytest_report_to_serializable(config=config, report=report)
+            for report in reports
+        ]
+
+
+class _ResultCache:
+    """Keys of the doc items that passed, see ``--sphinx-result-cache``.
+
+    The key of an item is a hash of everything that determines its outcome:
+    the content of its file, its examples, the optionflags, the python
+    version and the versions/contents of the dependencies declared in
+    ``sphinx_result_cache_dependencies``.
+
+    Under pytest-xdist the workers don't save the cache, but send the keys
+    of their items to the controller in the ``sphinx_result_cache`` user
+    property of the reports.  The controller is registered as a plugin to
+    collect them (see `pytest_runtest_logreport`).
+    """
+
+    _CACHE_PATH = "sphinx/result_cache"
+
+    def __init__(self, config: pytest.Config) -> None:
+        assert config.cache is not None
+        self.config = config
+        self.passed: dict[str, str] = config.cache.get(self._CACHE_PATH, {})
+        self.hits = 0
+        # the keys recorded in this session (None: the item didn't pass)
+        self._updates: dict[str, str | None] = {}
+        self._fingerprint: str | None = None
+        self._file_hashes: dict[Path, str] = {}
+
+    def _dependency_fingerprint(self) -> str:
+        if self._fingerprint is None:
+            rootpath = self.config.rootpath
+            digest = hashlib.sha256(sys.version.encode())
+            conf = self.config.getini("sphinx_conf")
+            if conf and (rootpath / conf).is_file():
+                digest.update((rootpath / conf).read_bytes())
+            for entry in self.config.getini("sphinx_result_cache_dependencies"):
+                if any(c in entry for c in "/\\*?["):
+                    for path in sorted(rootpath.glob(entry)):
+                        if path.is_file():
+                            digest.update(str(path.relative_to(rootpath)).encode())
+                            digest.update(path.read_bytes())
+                else:
+                    try:
+                        version = importlib.metadata.version(entry)
+                    except importlib.metadata.PackageNotFoundError:
+                        version = None
+                    digest.update(f"{entry}=={version}".encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def _file_hash(self, path: Path) -> str:
+        if path not in self._file_hashes:
+            self._file_hashes[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+        return self._file_hashes[path]
+
+    def key(self, item: SphinxDoctestItem) -> str:
+        digest = hashlib.sha256(self._dependency_fingerprint().encode())
+        digest.update(self._file_hash(item.path).encode())
+        digest.update(f"{item.name}\0{item.runner.optionflags}".encode())
+        for example in item.dtest.examples:
+            digest.update(
+                repr(
+                    (
+                        example.source,
+                        example.want,
+                        example.exc_msg,
+                        sorted(example.options.items()),
+                        getattr(example, "timeout", None),
+                    )
+                ).encode()
+            )
+        return digest.hexdigest()
+
+    def is_cached(self, item: SphinxDoctestItem) -> bool:
+        cached = self.passed.get(item.nodeid) == self.key(item)
+        if cached:
+            self.hits += 1
+        return cached
+
+    def record(self, item: SphinxDoctestItem, passed: bool) -> None:
+        key = self.key(item) if passed else None
+        self._update(item.nodeid, key)
+        if hasattr(self.config, "workerinput"):
+            item.user_properties.append(("sphinx_result_cache", key))
+
+    def _update(self, nodeid: str, key: str | None) -> None:
+        self._updates[nodeid] = key
+        if key is None:
+            self.passed.pop(nodeid, None)
+        else:
+            self.passed[nodeid] = key
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if report.when != "call":
+            return
+        for name, value in report.user_properties:
+            if name == "sphinx_result_cache":
+                self._update(report.nodeid, value)
+            elif name == "sphinx_cached":
+                self.hits += 1
+
+    def save(self) -> None:
+        """Merge the keys recorded in this session into the saved cache.
+
+        The cache is read again, so that the keys saved by other processes
+        in the meantime are kept.
+        """
+        if hasattr(self.config, "workerinput"):
+            # the controller saves the keys of the workers
+            return
+        assert self.config.cache is not None
+        passed = self.config.cache.get(self._CACHE_PATH, {})
+        for nodeid, key in self._updates.items():
+            if key is None:
+                passed.pop(nodeid, None)
+            else:
+                passed[nodeid] = key
+        self.config.cache.set(self._CACHE_PATH, passed)
+
+
+_SPHINX_CONF_SETTINGS = ("doctest_global_setup", "doctest_global_cleanup")
+
+
+def _read_sphinx_conf(path: Path) -> dict[str, str]:
+    """Read the doctest settings of a sphinx conf.py.
+
+    The settings are taken from the AST if they are assigned string literals
+    at the top level of the module.  Otherwise conf.py is executed.
+    """
+    tree = ast.parse(path.read_bytes(), str(path))
+    settings = {}
+    static_assignments = set()
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id in _SPHINX_CONF_SETTINGS
+            and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, str)
+        ):
+            settings[node.targets[0].id] = node.value.value
+            static_assignments.add(id(node.targets[0]))
+    if any(
+        isinstance(node, ast.Name)
+        and isinstance(node.ctx, ast.Store)
+        and node.id in _SPHINX_CONF_SETTINGS
+        and id(node) not in static_assignments
+        for node in ast.walk(tree)
+    ):
+        namespace = runpy.run_path(str(path))
+        settings = {
+            name: namespace[name] for name in _SPHINX_CONF_SETTINGS if name in namespace
+        }
+    return settings
+
+
+class _GlobalSetup(NamedTuple):
+    """The namespace of ``doctest_global_setup`` and ``doctest_global_cleanup``."""
+
+    namespace: dict[str, Any]
+    cleanup: str
+
+
+def _get_srcdir(config: pytest.Config) -> Path:
+    """Return the directory of the conf.py of the docs, or the rootdir."""
+    conf = config.getini("sphinx_conf")
+    return (config.rootpath / conf).parent if conf else config.rootpath
+
+
+def _rootdir_relpath(config: pytest.Config, path: Path) -> str:
+    """Return `path` relative to the rootdir, if it is inside the rootdir."""
+    try:
+        return path.relative_to(config.rootpath).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def _relpath(path: Path, start: Path) -> str:
+    """Return `path` relative to the directory of the file `start`."""
+    return os.path.relpath(path, start.parent)
+
+
+def _get_global_namespace(config: pytest.Config) -> dict[str, Any]:
+    """Return the namespace created by the ``doctest_global_setup``.
+
+    The setup of the conf.py configured by the ``sphinx_conf`` ini-option is
+    run once per session (and once per xdist worker).  Every doctest gets a
+    (shallow) copy of the namespace.
+    """
+    global_setup = config.stash.get(_GLOBAL_SETUP_KEY, None)
+    if global_setup is None:
+        namespace: dict[str, Any] = {}
+        settings = {}
+        conf = config.getini("sphinx_conf")
+        if conf:
+            path = config.rootpath / conf
+            settings = _read_sphinx_conf(path)
+            setup = settings.get("doctest_global_setup")
+            if setup:
+                namespace["__name__"] = "__main__"
+                exec(compile(setup, f"{path}:doctest_global_setup", "exec"), namespace)
+                namespace.pop("__builtins__", None)
+        global_setup = _GlobalSetup(
+            namespace, settings.get("doctest_global_cleanup", "")
+        )
+        config.stash[_GLOBAL_SETUP_KEY] = global_setup
+    return global_setup.namespace
+
+
+class _CollectionStats:
+    """Timings of the phases of the collection, see ``--sphinx-stats``.
+
+    The time of a phase doesn't include the time of the phases nested in it,
+    e.g. the time of ``find`` excludes the parsing of the docstrings.
+    """
+
+    #: the phases and their descriptions
+    PHASES = {
+        "read": "reading text files and notebooks",
+        "scan": "finding directives and parsing their options",
+        "examples": "creating examples from the directives",
+        "import": "importing python modules",
+        "find": "finding the docstrings of python modules",
+    }
+
+    def __init__(self) -> None:
+        self.timings = dict.fromkeys(self.PHASES, 0.0)
+        self.counters = dict.fromkeys(
+            (
+                "files",
+                "files with directives",
+                "docstrings",
+                "sections",
+                "examples",
+                "imports",
+            ),
+            0,
+        )
+        # start time and time of the nested phases of the running phases
+        self._running: list[list[float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        running = [time.perf_counter(), 0.0]
+        self._running.append(running)
+        try:
+            yield
+        finally:
+            self._running.pop()
+            elapsed = time.perf_counter() - running[0]
+            self.timings[name] += elapsed - running[1]
+            if self._running:
+                self._running[-1][1] += elapsed
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        return {"timings": self.timings, "counters": self.counters}
 
-    def collect(self) -> Iterator[_pytest.doctest.DoctestItem]:
-        # inspired by doctest.testfile; ideally we would use it directly,
-        # but it doesn't support passing a custom checker
-        encoding = self.config.getini("doctest_encoding")
-        text = self.fspath.read_text(encoding)
-        name = self.fspath.basename
-        file_extension = Path(self.fspath).suffix
 
-        optionflags = _pytest.doctest.get_optionflags(self.config)  # type:ignore
+def _phase(
+    stats: _CollectionStats | None, name: str
+) -> contextlib.AbstractContextManager[None]:
+    return contextlib.nullcontext() if stats is None else stats.phase(name)
+
+
+def _get_runner(config: pytest.Config) -> SphinxDocTestRunner:
+    """Return the runner shared by all collected files of a session.
+
+    The runner, its output checker and the optionflags resolved from the
+    ``doctest_optionflags`` ini-option are created once per session instead
+    of once per collected file.
+    """
+    runner = config.stash.get(_RUNNER_KEY, None)
+    if runner is None:
+        event_loop_scope = config.getini("sphinx_event_loop_scope")
+        if event_loop_scope not in _EVENT_LOOP_SCOPES:
+            raise pytest.UsageError(
+                f"sphinx_event_loop_scope must be one of {_EVENT_LOOP_SCOPES}, "
+                f"not {event_loop_scope!r}"
+            )
         runner = SphinxDocTestRunner(
             verbose=False,
-            optionflags=optionflags,
+            optionflags=_pytest.doctest.get_optionflags(config),  # type:ignore
             checker=_pytest.doctest._get_checker(),
         )
+        runner.event_loop_scope = event_loop_scope
+        runner.group_workers = config.getoption("sphinx_group_workers")
+        runner.early_mismatch = config.getoption("sphinx_early_mismatch")
+        runner.keep_snapshots = config.getoption("sphinx_watch")
+        runner.record_examples = config.getoption("sphinx_example_records") or bool(
+            config.getoption("sphinx_example_report")
+        )
+        try:
+            timeout = float(config.getini("sphinx_timeout"))
+        except ValueError:
+            raise pytest.UsageError(
+                "sphinx_timeout must be a number, "
+                f"not {config.getini('sphinx_timeout')!r}"
+            ) from None
+        runner.timeout = timeout or None
+        runner.track_resources = config.getoption("sphinx_resource_usage")
+        try:
+            runner.report_max_size = _parse_size(
+                config.getini("sphinx_report_max_size") or "0"
+            )
+        except ValueError as e:
+            raise pytest.UsageError(f"sphinx_report_max_size: {e}") from None
+        cache = getattr(config, "cache", None)
+        if cache is not None:
+            runner.spill_dir = cache.mkdir("sphinx-spill")
+        config.stash[_RUNNER_KEY] = runner
+    return runner
+
+
+def _get_scan_engine(config: pytest.Config) -> _LineScanEngine:
+    """Return the engine selected by the ``sphinx_scan_engine`` ini-option."""
+    return _SCAN_ENGINES[config.getini("sphinx_scan_engine")]
+
+
+#: Outputs (expected and actual together) with more characters are diffed by
+#: `_large_output_difference` instead of the output checker.
+_LARGE_OUTPUT_SIZE = 100_000
+#: Maximum number of lines of the diff of large outputs.
+_LARGE_DIFF_MAX_LINES = 200
+#: Maximum number of differing lines of each output that difflib compares.
+_LARGE_DIFF_MAX_COMPARED_LINES = 5000
+
+
+def _output_difference(
+    checker: doctest.OutputChecker, example: doctest.Example, got: str, flags: int
+) -> str:
+    if len(example.want) + len(got) > _LARGE_OUTPUT_SIZE:
+        return _large_output_difference(example.want, got)
+    return checker.output_difference(example, got, flags)
+
+
+def _large_output_difference(want: str, got: str, context: int = 3) -> str:
+    """Diff outputs that are too large for the diffs of `doctest`.
+
+    The common leading and trailing lines are skipped, at most
+    `_LARGE_DIFF_MAX_COMPARED_LINES` of the remaining lines are compared and
+    only the first `_LARGE_DIFF_MAX_LINES` lines of their unified diff are
+    shown.  The report flags of doctest are ignored.
+    """
+    want_lines = want.splitlines()
+    got_lines = got.splitlines()
+    common = min(len(want_lines), len(got_lines))
+    start = 0
+    while start < common and want_lines[start] == got_lines[start]:
+        start += 1
+    end = 0
+    while end < common - start and want_lines[-1 - end] == got_lines[-1 - end]:
+        end += 1
+    start = max(start - context, 0)
+    want_diff_lines = want_lines[start : len(want_lines) - end + context]
+    got_diff_lines = got_lines[start : len(got_lines) - end + context]
+
+    def offset_hunk_header(match: re.Match[str]) -> str:
+        return (
+            f"@@ -{int(match.group(1)) + start}{match.group(2) or ''} "
+            f"+{int(match.group(3)) + start}{match.group(4) or ''} @@"
+        )
+
+    diff = [
+        re.sub(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@", offset_hunk_header, line)
+        for line in difflib.unified_diff(
+            want_diff_lines[:_LARGE_DIFF_MAX_COMPARED_LINES],
+            got_diff_lines[:_LARGE_DIFF_MAX_COMPARED_LINES],
+            fromfile="expected",
+            tofile="got",
+            lineterm="",
+            n=context,
+        )
+    ]
+    lines = diff[:_LARGE_DIFF_MAX_LINES]
+    if len(diff) > len(lines):
+        lines.append(f"... [{len(diff) - len(lines)} more lines of the diff]")
+    if max(len(want_diff_lines), len(got_diff_lines)) > (
+        _LARGE_DIFF_MAX_COMPARED_LINES
+    ):
+        lines.append(
+            f"... [only the first {_LARGE_DIFF_MAX_COMPARED_LINES} differing lines "
+            "were compared]"
+        )
+    return (
+        f"Expected and got differ ({len(want_lines)} and {len(got_lines)} lines, "
+        "only a part of the diff is shown):\n"
+        + textwrap.indent("\n".join(lines), "    ")
+        + "\n"
+    )
+
+
+class _LazyLines(Sequence[str]):
+    """Lines of which the last part is only computed when they are accessed.
+
+    This defers diffs of failure reports until the report is displayed,
+    which never happens e.g. for xfailed items.
+    """
+
+    def __init__(self, head: list[str], get_tail: Callable[[], str]) -> None:
+        self._head = head
+        self._get_tail = get_tail
+
+    @functools.cached_property
+    def _lines(self) -> list[str]:
+        return [*self._head, *self._get_tail().split("\n")]
+
+    def __getitem__(self, index: Any) -> Any:
+        return self._lines[index]
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+
+class SphinxDoctestItem(DoctestItem):
+    runner: SphinxDocTestRunner
+
+    _cached = False
+
+    #: the globals before every example of the last run, see
+    #: `SphinxDocTestRunner.keep_snapshots`
+    snapshots: Sequence[dict[str, Any]] = ()
+
+    @property
+    def isolated(self) -> bool:
+        """Whether the item is run by the fork server, see ``--sphinx-isolate``."""
+        if self.config.getoption("sphinx_isolate"):
+            return True
+        path = _rootdir_relpath(self.config, self.path)
+        return any(
+            fnmatch.fnmatch(path, pattern)
+            for pattern in self.config.getini("sphinx_isolate")
+        )
+
+    def setup(self) -> None:
+        if _all_skipped(self.dtest.examples):
+            # before the fixtures and the globs are set up; reported at the
+            # location of the item, like a skip marker
+            raise pytest.skip.Exception(
+                "all examples are skipped (:skipif: or +SKIP)",
+                _use_item_location=True,
+            )
+        result_cache = self.config.stash.get(_RESULT_CACHE_KEY, None)
+        if result_cache is not None and result_cache.is_cached(self):
+            # neither fixtures nor globs are needed, the item isn't run
+            self._cached = True
+            self.user_properties.append(("sphinx_cached", True))
+            return
+        super().setup()
+
+    def runtest(self) -> None:
+        if self._cached:
+            return
+        result_cache = self.config.stash.get(_RESULT_CACHE_KEY, None)
+        passed = False
+        start = time.perf_counter()
+        try:
+            self._runtest()
+            passed = True
+        finally:
+            # used for distributing the items with --sphinx-shard
+            self.config.stash[_DURATIONS_KEY][self.nodeid] = time.perf_counter() - start
+            if result_cache is not None:
+                result_cache.record(self, passed)
+
+    def repr_failure(  # type: ignore[override]
+        self, excinfo: pytest.ExceptionInfo[BaseException]
+    ) -> str | TerminalRepr:
+        if isinstance(excinfo.value, doctest.DocTestFailure):
+            failure_repr: str | TerminalRepr = self._repr_doctest_failure(excinfo.value)
+        else:
+            failure_repr = super().repr_failure(excinfo)
+        if isinstance(self.parent, SphinxDoctestTextfile) and isinstance(
+            failure_repr, ReprFailDoctest
+        ):
+            for reprlocation, _ in failure_repr.reprlocation_lines:
+                if reprlocation.lineno is not None:
+                    self.parent._describe_location(reprlocation)
+        return failure_repr
+
+    def _repr_doctest_failure(self, failure: doctest.DocTestFailure) -> ReprFailDoctest:
+        """Like `DoctestItem.repr_failure`, but the diff is computed lazily."""
+        example = failure.example
+        test = failure.test
+        if test.lineno is None:
+            lineno = None
+            lines = ["EXAMPLE LOCATION UNKNOWN, not showing all tests of that example"]
+            indent = ">>>"
+            for line in example.source.splitlines():
+                lines.append(f"??? {indent} {line}")
+                indent = "..."
+        else:
+            lineno = test.lineno + example.lineno + 1
+            assert test.docstring is not None
+            lines = [
+                f"{i + test.lineno + 1:03d} {x}"
+                for i, x in enumerate(test.docstring.splitlines())
+            ]
+            lines = lines[max(example.lineno - 9, 0) : example.lineno + 1]
+        reprlocation = ReprFileLocation(
+            test.filename,
+            lineno,  # type: ignore[arg-type]
+            type(failure).__name__,
+        )
+        report_choice = _pytest.doctest._get_report_choice(  # type: ignore
+            self.config.getoption("doctestreport")
+        )
+        get_diff = functools.partial(
+            _output_difference,
+            self.runner._checker,
+            example,
+            failure.got,
+            report_choice,
+        )
+        return ReprFailDoctest([(reprlocation, _LazyLines(lines, get_diff))])
+
+    def _runtest(self) -> None:
+        self.runner.nodeid = self.nodeid
+        failed = True
+        try:
+            super().runtest()
+            failed = False
+        finally:
+            usage = self.runner.resource_usage
+            self.runner.resource_usage = None
+            if self.runner.record_examples:
+                self._add_example_records(self.runner.example_records)
+            if self.runner.keep_snapshots:
+                self.snapshots = self.runner.snapshots
+            if usage is not None:
+                self._check_resource_usage(usage, failed)
+
+    def _add_example_records(self, records: list[ExampleRecord]) -> None:
+        """Add the records as JSON to the user properties of the item.
+
+        The properties end up in the JUnit XML report and in the file of
+        ``--sphinx-example-report`` (see `pytest_runtest_logreport`).
+        """
+        file = _rootdir_relpath(self.config, self.path)
+        for record in records:
+            self.user_properties.append(
+                (
+                    "sphinx_example",
+                    json.dumps({"file": file, **record._asdict()}),
+                )
+            )
+
+    def _check_resource_usage(self, usage: ResourceUsage, failed: bool) -> None:
+        """Record `usage` in the user properties and check the memory limit.
+
+        If the item `failed` already, exceeding the limit is only a warning,
+        so that the failure of the doctest isn't hidden.
+        """
+        self.user_properties.append(("sphinx_peak_memory", usage.peak_memory))
+        if usage.lineno is not None:
+            self.user_properties.append(("sphinx_peak_memory_lineno", usage.lineno))
+        if usage.rss_delta is not None:
+            self.user_properties.append(("sphinx_rss_delta", usage.rss_delta))
+        for example_usage in self.runner.example_resource_usage:
+            # the line of an example is unknown e.g. in a __test__ string
+            if example_usage.lineno is not None:
+                self.user_properties.append(
+                    (
+                        f"sphinx_peak_memory[{example_usage.lineno}]",
+                        example_usage.peak_memory,
+                    )
+                )
+
+        limit = self.config.stash.get(_MEMORY_LIMIT_KEY, None)
+        if limit is None or usage.peak_memory <= limit.size:
+            return
+        message = (
+            f"doctest allocated {_format_size(usage.peak_memory)}, "
+            f"which exceeds the sphinx_memory_limit of {limit.text}"
+        )
+        if usage.lineno is not None:
+            message += f" (worst example at line {usage.lineno})"
+        if limit.action == "fail" and not failed:
+            pytest.fail(message, pytrace=False)
+        else:
+            self.warn(pytest.PytestWarning(message))
+
+
+def _all_skipped(examples: list[doctest.Example]) -> bool:
+    """Whether all `examples` are skipped by a :skipif: or the SKIP option."""
+    return all(example.options.get(doctest.SKIP, False) for example in examples)
+
+
+def _set_source_linenos(test: doctest.DocTest) -> None:
+    """Set the line in the file that is reported for every example of `test`.
+
+    This is the same line that pytest reports for a failing example.
+    """
+    for example in test.examples:
+        if test.lineno is not None and example.lineno is not None:
+            example.source_lineno = test.lineno + example.lineno + 1
+
+
+def _iter_docstrings(
+    tree: ast.Module, module_name: str
+) -> Iterator[tuple[str, ast.Constant]]:
+    """Yield the names and the nodes of the docstrings in a module.
+
+    The names are the ones used by `doctest.DocTestFinder` for the
+    docstrings of the module, its classes, functions and methods.
+    """
+
+    def get_docstring_node(
+        node: ast.Module | ast.ClassDef | ast.FunctionDef | ast.AsyncFunctionDef,
+    ) -> ast.Constant | None:
+        if (
+            node.body
+            and isinstance(node.body[0], ast.Expr)
+            and isinstance(node.body[0].value, ast.Constant)
+            and isinstance(node.body[0].value.value, str)
+        ):
+            return node.body[0].value
+        return None
+
+    def visit(
+        node: ast.Module | ast.ClassDef, name: str
+    ) -> Iterator[tuple[str, ast.Constant]]:
+        docstring_node = get_docstring_node(node)
+        if docstring_node is not None:
+            yield name, docstring_node
+        for child in node.body:
+            if isinstance(child, ast.ClassDef):
+                yield from visit(child, f"{name}.{child.name}")
+            elif isinstance(child, ast.FunctionDef | ast.AsyncFunctionDef):
+                if any(
+                    isinstance(decorator, ast.Attribute)
+                    and decorator.attr in ("setter", "deleter")
+                    for decorator in child.decorator_list
+                ):
+                    # the docstring of a property is the one of its getter
+                    continue
+                docstring_node = get_docstring_node(child)
+                if docstring_node is not None:
+                    yield f"{name}.{child.name}", docstring_node
+
+    yield from visit(tree, module_name)
+
+
+def _get_docstring_linenos(source: str, module_name: str) -> dict[str, int]:
+    """Map the names of the docstrings in `source` to their (0-based) lines.
+
+    The line is the line of the opening quotes of the docstring.
+    """
+    return {
+        name: node.lineno - 1
+        for name, node in _iter_docstrings(ast.parse(source), module_name)
+    }
+
+
+class SphinxDocTestFinder(doctest.DocTestFinder):
+    """A `doctest.DocTestFinder` tailored to sphinx doctest directives.
+
+    Like the stock finder it walks the module, its classes, functions,
+    methods and properties, but
+
+    * only docstrings that may contain a directive (see
+      `_DIRECTIVE_PREFILTER_RE`) are parsed and turned into doctests,
+    * the lines of the docstrings are taken from the AST.  The stock finder
+      guesses them with regular expressions from the source lines and from
+      the code objects of the functions, which fails for properties and for
+      functions wrapped by decorators,
+    * the source lines of the module are only read if the line of a
+      docstring is not known from the AST.
+    """
+
+    def __init__(self, docstring_linenos: dict[str, int], **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._docstring_linenos = docstring_linenos
+        self._source_lines: list[str] | None = None
+
+    def find(  # type:ignore[override]
+        self,
+        obj: object,
+        name: str | None = None,
+        module: types.ModuleType | None = None,
+        globs: dict[str, Any] | None = None,
+        extraglobs: dict[str, Any] | None = None,
+    ) -> list[doctest.DocTest]:
+        if name is None:
+            name = obj.__name__  # type:ignore[attr-defined]
+        if module is None:
+            module = inspect.getmodule(obj)
+        if globs is None:
+            globs = {} if module is None else module.__dict__.copy()
+        else:
+            globs = globs.copy()
+        if extraglobs is not None:
+            globs.update(extraglobs)
+        globs.setdefault("__name__", "__main__")
+        self._source_lines = None
+
+        # walk the objects in the same (depth-first) order as the stock finder,
+        # such that objects with several names get the same name
+        tests = []
+        seen = set()
+        stack: list[tuple[str, object]] = [(name, obj)]
+        while stack:
+            name, obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            test = self._get_test(obj, name, module, globs)
+            if test is not None:
+                tests.append(test)
+            if self._recurse:  # type:ignore[attr-defined]
+                stack.extend(reversed(list(self._iter_members(obj, name, module))))
+        tests.sort()
+        return tests
+
+    def _iter_members(
+        self, obj: object, name: str, module: types.ModuleType | None
+    ) -> Iterator[tuple[str, object]]:
+        """Yield the names and the objects that may have doctests in `obj`."""
+        if inspect.ismodule(obj):
+            for valname, val in obj.__dict__.items():
+                if (inspect.isroutine(val) or inspect.isclass(val)) and (
+                    self._from_module(module, val)
+                ):
+                    yield f"{name}.{valname}", val
+            for valname, val in getattr(obj, "__test__", {}).items():
+                if not isinstance(valname, str):
+                    raise ValueError(
+                        "DocTestFinder.find: __test__ keys must be strings: "
+                        f"{type(valname)!r}"
+                    )
+                yield f"{name}.__test__.{valname}", val
+        elif inspect.isclass(obj):
+            for valname, member in obj.__dict__.items():
+                val = (
+                    member.__func__
+                    if isinstance(member, staticmethod | classmethod)
+                    else member
+                )
+                if (
+                    inspect.isroutine(val)
+                    or inspect.isclass(val)
+                    or isinstance(val, property)
+                ) and self._from_module(module, val):
+                    yield f"{name}.{valname}", val
+
+    def _from_module(self, module: types.ModuleType | None, obj: object) -> bool:
+        # most objects know the name of their module, which is much cheaper
+        # than `inspect.getmodule`
+        module_name = getattr(obj, "__module__", None)
+        if module is not None and isinstance(module_name, str):
+            return module_name == module.__name__
+        return super()._from_module(module, obj)  # type:ignore[misc,no-any-return]
+
+    def _get_test(  # type:ignore[override]
+        self,
+        obj: object,
+        name: str,
+        module: types.ModuleType | None,
+        globs: dict[str, Any],
+        *args: Any,
+    ) -> doctest.DocTest | None:
+        if isinstance(obj, str):
+            docstring = obj
+        else:
+            try:
+                docstring = obj.__doc__
+            except (TypeError, AttributeError):
+                docstring = None
+            if docstring is not None and not isinstance(docstring, str):
+                docstring = str(docstring)
+        if not docstring or not _DIRECTIVE_PREFILTER_RE.search(docstring):
+            return None
+
+        lineno = self._docstring_linenos.get(name)
+        if lineno is None:
+            if self._source_lines is None and module is not None:
+                self._source_lines = _get_module_source_lines(module)
+            lineno = self._find_lineno(obj, self._source_lines)  # type:ignore[attr-defined]
+
+        if module is None:
+            filename = None
+        else:
+            # __file__ can be None for namespace packages.
+            filename = getattr(module, "__file__", None) or module.__name__
+            if filename.endswith(".pyc"):
+                filename = filename[:-1]
+        return self._parser.get_doctest(  # type:ignore[attr-defined,no-any-return]
+            docstring, globs, name, filename, lineno
+        )
+
+
+def _get_module_source_lines(module: types.ModuleType) -> list[str] | None:
+    try:
+        filename = inspect.getsourcefile(module)
+    except TypeError:
+        return None
+    if not filename:
+        return None
+    return linecache.getlines(filename, module.__dict__) or None
+
+
+class SphinxDocTestParser:
+    def __init__(
+        self,
+        stats: _CollectionStats | None = None,
+        engine: _LineScanEngine | None = None,
+    ) -> None:
+        #: the malformed directives of all parsed docstrings, together with
+        #: the (0-based) line of the docstring in the file
+        self.errors: list[tuple[int, DirectiveError]] = []
+        self.stats = stats
+        self.engine = engine
+
+    def get_doctest(
+        self,
+        docstring: str,
+        globs: dict[str, Any],
+        name: str,
+        filename: str,
+        lineno: int,
+    ) -> doctest.DocTest:
+        # TODO document why we need to overwrite? get_doctest
+        examples, errors = _collect_examples(
+            docstring, DirectiveSyntax.RST, globs, self.stats, self.engine
+        )
+        self.errors.extend((lineno or 0, error) for error in errors)
+        test = doctest.DocTest(
+            examples=examples,
+            globs=globs,
+            name=name,
+            filename=filename,
+            lineno=lineno,
+            docstring=docstring,
+        )
+        _set_source_linenos(test)
+        return test
+
+
+_INCLUDE_RE = re.compile(r"(?P<indent>\s*)\.\.\s+include::\s*(?P<path>\S[^\n]*?)\s*$")
+
+
+class _IncludeSpan(NamedTuple):
+    """Lines [start, end) of a text with resolved includes that come from `path`."""
+
+    start: int
+    end: int
+    path: Path
+
+
+class _ResolvedText(NamedTuple):
+    lines: list[str]
+    #: the spans of the files that are included by the file itself
+    spans: list[_IncludeSpan]
+    #: the file and the (0-based) line in it of every line of `lines`
+    origins: list[tuple[Path, int]]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def content_line(self, lineno: int) -> int:
+        """Return the last line with content up to the (0-based) `lineno`.
+
+        The line of an example is the (blank) line after its block, which
+        may come from the including file.
+        """
+        content_lineno = min(lineno, len(self.lines) - 1)
+        while content_lineno > 0 and not self.lines[content_lineno].strip():
+            content_lineno -= 1
+        return content_lineno
+
+    def locate(self, lineno: int) -> tuple[Path, int]:
+        """Map a (0-based) line to a file and a line in it.
+
+        Blank lines belong to the file of the preceding line with content.
+        """
+        content_lineno = self.content_line(lineno)
+        path, line = self.origins[content_lineno]
+        return path, line + lineno - content_lineno
+
+
+def _resolve_includes(
+    path: Path,
+    text: str,
+    srcdir: Path,
+    encoding: str,
+    _including: tuple[Path, ...] = (),
+) -> _ResolvedText:
+    """Replace the ``.. include::`` directives in an RST text by the files.
+
+    Absolute paths are relative to `srcdir`, like in sphinx.  Includes of
+    missing files, of standard files (``<isonum.txt>``) and recursive
+    includes are left alone.  The options of the directives are ignored.
+    """
+    lines = text.splitlines()
+    resolved: list[str] = []
+    spans: list[_IncludeSpan] = []
+    origins: list[tuple[Path, int]] = []
+    i = 0
+    while i < len(lines):
+        match = _INCLUDE_RE.match(lines[i])
+        if match is None:
+            resolved.append(lines[i])
+            origins.append((path, i))
+            i += 1
+            continue
+        # skip the options of the directive
+        indent = match.group("indent")
+        j = i + 1
+        while (
+            j < len(lines)
+            and lines[j][: len(indent) + 1].isspace()
+            and (lines[j].strip())
+        ):
+            j += 1
+        target = match.group("path")
+        if target.startswith("/"):
+            fragment_path = srcdir / target.lstrip("/")
+        else:
+            fragment_path = path.parent / target
+        fragment_path = Path(os.path.normpath(fragment_path))
+        if (
+            target.startswith("<")
+            or fragment_path in (*_including, path)
+            or not fragment_path.is_file()
+        ):
+            resolved.extend(lines[i:j])
+            origins.extend((path, k) for k in range(i, j))
+            i = j
+            continue
+
+        fragment = _resolve_includes(
+            fragment_path,
+            fragment_path.read_text(encoding),
+            srcdir,
+            encoding,
+            (*_including, path),
+        )
+        start = len(resolved)
+        resolved.extend(indent + line if line else line for line in fragment.lines)
+        origins.extend(fragment.origins)
+        spans.append(_IncludeSpan(start, len(resolved), fragment_path))
+        i = j
+    return _ResolvedText(resolved, spans, origins)
+
+
+def _fragment_key(path: Path, preceding_examples: list[SphinxExample]) -> str:
+    """Identify the examples of a file run after `preceding_examples`."""
+    digest = hashlib.sha256(str(path).encode())
+    for example in preceding_examples:
+        digest.update(repr((example.source, example.want, example.options)).encode())
+    return digest.hexdigest()
+
+
+def _mark_fragments(
+    path: Path, examples: list[SphinxExample], resolved_text: _ResolvedText | None
+) -> list[str]:
+    """Set the `fragment` of the examples that come from included files.
+
+    The key of a fragment identifies the included file and the examples that
+    precede it in the including file, i.e. the context in which it is run.
+    The examples of a file without includes form a fragment without
+    context, such that a file that is both collected and included at the top
+    of other files is run once.  Return the keys of the fragments.
+    """
+    if resolved_text is None or not resolved_text.spans:
+        for example in examples:
+            example.fragment = _fragment_key(path, [])
+        return [_fragment_key(path, [])] if examples else []
+
+    keys = []
+    for span in resolved_text.spans:
+        indices = [
+            i
+            for i, example in enumerate(examples)
+            if span.start <= resolved_text.content_line(example.lineno) < span.end
+        ]
+        if indices:
+            key = _fragment_key(span.path, examples[: indices[0]])
+            for i in indices:
+                examples[i].fragment = key
+            keys.append(key)
+    return keys
+
+
+class SphinxDoctestTextfile(pytest.Module):
+    obj = None
+
+    #: the text of the file with resolved includes, see `_resolve_includes`
+    resolved_text: _ResolvedText | None = None
+
+    def _read_text(self) -> str:
+        encoding = self.config.getini("doctest_encoding")
+        return self.fspath.read_text(encoding)  # type:ignore[no-any-return]
+
+    def locate_line(self, lineno: int) -> tuple[Path, int]:
+        """Map a (0-based) line of the text to a file and a line in it."""
+        if self.resolved_text is None or not self.resolved_text.lines:
+            return self.path, lineno
+        return self.resolved_text.locate(lineno)
+
+    def _format_directive_error(self, lineno: int) -> str:
+        """Format the location of a (0-based) line of the text of the file."""
+        path, line = self.locate_line(lineno)
+        if path == self.path:
+            return f"{self.nodeid}:{line + 1}"
+        return f"{self.nodeid}:{lineno + 1} ({_relpath(path, self.path)}:{line + 1})"
+
+    def _describe_location(self, reprlocation: ReprFileLocation) -> None:
+        """Point the location of a failure to the file of the example."""
+        path, line = self.locate_line(reprlocation.lineno - 1)
+        if path == self.path:
+            reprlocation.lineno = line + 1
+        else:
+            reprlocation.message += (
+                f" (included from {_relpath(path, self.path)}, line {line + 1})"
+            )
+
+    def collect(self) -> Iterator[SphinxDoctestItem | SphinxInvalidDirectivesItem]:
+        # inspired by doctest.testfile; ideally we would use it directly,
+        # but it doesn't support passing a custom checker
+        stats = self.config.stash.get(_STATS_KEY, None)
+        with _phase(stats, "read"):
+            text = self._read_text()
+        name = self.fspath.basename
+        file_extension = Path(self.fspath).suffix
+        runner = _get_runner(self.config)
 
         syntax = _FILE_EXTENSION_TO_SYNTAX[file_extension]
-        examples = docstring2examples(text, syntax=syntax)
+        if syntax is DirectiveSyntax.RST and "include::" in text:
+            with _phase(stats, "read"):
+                self.resolved_text = _resolve_includes(
+                    self.path,
+                    text,
+                    _get_srcdir(self.config),
+                    self.config.getini("doctest_encoding"),
+                )
+            text = self.resolved_text.text
+        examples, errors = _collect_examples(
+            text, syntax, None, stats, _get_scan_engine(self.config)
+        )
+        if syntax is DirectiveSyntax.RST and self.config.getini(
+            "sphinx_dedup_includes"
+        ):
+            runner.fragment_counts.update(
+                _mark_fragments(self.path, examples, self.resolved_text)
+            )
+        if stats is not None:
+            stats.counters["files"] += 1
+            stats.counters["files with directives"] += bool(examples or errors)
 
         test = doctest.DocTest(
             examples=examples,
-            globs={},
+            # the doctest_global_setup isn't needed if nothing is run
+            globs={} if _all_skipped(examples) else _get_global_namespace(self.config),
             name=name,
             filename=name,
             lineno=0,
             docstring=text,
         )
+        _set_source_linenos(test)
 
         if test.examples:
-            yield DoctestItem.from_parent(
+            yield SphinxDoctestItem.from_parent(
                 parent=self,  # type:ignore
                 name=test.name,
                 runner=runner,
                 dtest=test,
             )
+        if errors:
+            yield SphinxInvalidDirectivesItem.from_parent(
+                self,
+                name=f"{name}[invalid-directives]",
+                errors=[
+                    f"{self._format_directive_error(error.lineno)}: {error.message}"
+                    for error in errors
+                ],
+            )
+
+
+def _iter_notebook_markdown_cells(path: Path) -> Iterator[tuple[int, str]]:
+    """Yield the index and the source of the markdown cells of a notebook.
+
+    If ijson is installed, the notebook is streamed and the outputs of the
+    code cells (e.g. base64 encoded images) are never loaded into memory.
+    Otherwise the whole notebook is decoded with the json module.
+    """
+    with path.open("rb") as f:
+        if ijson is None:
+            for index, cell in enumerate(json.load(f).get("cells", [])):
+                if cell.get("cell_type") == "markdown":
+                    source = cell.get("source", "")
+                    yield index, source if isinstance(source, str) else "".join(source)
+            return
+
+        index = -1
+        cell_type = None
+        source: list[str] = []
+        for prefix, event, value in ijson.parse(f):
+            if prefix == "cells.item":
+                if event == "start_map":
+                    index += 1
+                    cell_type = None
+                    source = []
+                elif event == "end_map" and cell_type == "markdown":
+                    yield index, "".join(source)
+            elif prefix == "cells.item.cell_type":
+                cell_type = value
+            elif event == "string" and prefix in (
+                "cells.item.source",
+                "cells.item.source.item",
+            ):
+                source.append(value)
+
+
+def _join_notebook_cells(path: Path) -> tuple[str, list[tuple[int, int]]]:
+    """Join the markdown cells of a notebook.
+
+    Return the joined text and the line at which every cell starts in it,
+    together with the index of the cell.
+    """
+    cell_starts = []
+    lines: list[str] = []
+    for index, source in _iter_notebook_markdown_cells(path):
+        cell_starts.append((len(lines), index))
+        lines.extend(source.splitlines())
+        lines.append("")
+    return "\n".join(lines), cell_starts
+
+
+class SphinxDoctestNotebook(SphinxDoctestTextfile):
+    """Collect the doctest directives in the markdown cells of a notebook.
+
+    The sources of the cells are joined (in MyST syntax), such that the
+    examples of all cells share their globals, like the code cells of a
+    notebook do.
+    """
+
+    #: the line of the joined text at which a cell starts and its index
+    cell_starts: list[tuple[int, int]]
+
+    def _read_text(self) -> str:
+        text, self.cell_starts = _join_notebook_cells(self.path)
+        return text
+
+    def locate(self, lineno: int) -> tuple[int, int]:
+        """Map a (0-based) line of the joined text to a cell and a line in it."""
+        position = bisect.bisect_right(self.cell_starts, (lineno, sys.maxsize)) - 1
+        start, index = self.cell_starts[max(position, 0)]
+        return index, lineno - start
+
+    def _describe_location(self, reprlocation: ReprFileLocation) -> None:
+        # the line numbers refer to the joined cells of the notebook
+        cell, line = self.locate(reprlocation.lineno - 1)
+        reprlocation.message += f" (cell {cell}, line {line + 1})"
+
+    def _format_directive_error(self, lineno: int) -> str:
+        index, cell_lineno = self.locate(lineno)
+        return f"{self.nodeid}[cell {index}]:{cell_lineno + 1}"
+
+
+def _invalid_directives_item(
+    collector: pytest.Collector, errors: list[tuple[int, DirectiveError]]
+) -> SphinxInvalidDirectivesItem:
+    """Create the item for the malformed directives in the docstrings of a file.
+
+    `errors` holds the (0-based) lines of the docstrings and their errors.
+    """
+    assert collector.path is not None
+    return SphinxInvalidDirectivesItem.from_parent(
+        collector,
+        name=f"{collector.path.name}[invalid-directives]",
+        errors=[
+            f"{collector.nodeid}:{offset + error.lineno + 1}: {error.message}"
+            for offset, error in errors
+        ],
+    )
 
 
 class SphinxDoctestModule(pytest.Module):
-    def collect(self) -> Iterator[_pytest.doctest.DoctestItem]:
+    def _import_module(self) -> types.ModuleType:
+        return import_path(
+            self.path, root=self.config.rootpath, consider_namespace_packages=False
+        )
+
+    def _get_docstring_linenos(self, module: types.ModuleType) -> dict[str, int]:
+        source = importlib.util.decode_source(self.path.read_bytes())
+        return _get_docstring_linenos(source, module.__name__)
+
+    def collect(self) -> Iterator[SphinxDoctestItem | SphinxInvalidDirectivesItem]:
+        stats = self.config.stash.get(_STATS_KEY, None)
         try:
-            module = import_path(
-                self.path, root=self.config.rootpath, consider_namespace_packages=False
-            )
+            with _phase(stats, "import"):
+                module = self._import_module()
         except ImportError:
             if self.config.getvalue("doctest_ignore_import_errors"):
                 pytest.skip(f"unable to import module {self.path!r}")
             else:
                 raise
-        optionflags = _pytest.doctest.get_optionflags(self.config)  # type:ignore
 
-        finder = doctest.DocTestFinder(parser=SphinxDocTestParser())  # type:ignore
-        runner = SphinxDocTestRunner(
-            verbose=False,
-            optionflags=optionflags,
-            checker=_pytest.doctest._get_checker(),
-        )
-
-        for test in finder.find(module, module.__name__):
+        with _phase(stats, "find"):
+            parser = SphinxDocTestParser(stats, _get_scan_engine(self.config))
+            finder = SphinxDocTestFinder(
+                self._get_docstring_linenos(module), parser=parser
+            )
+            global_namespace = _get_global_namespace(self.config)
+            tests = finder.find(
+                module,
+                module.__name__,
+                globs={**global_namespace, **module.__dict__}
+                if global_namespace
+                else None,
+            )
+        runner = _get_runner(self.config)
+        if stats is not None:
+            stats.counters["files"] += 1
+            stats.counters["imports"] += 1
+            stats.counters["files with directives"] += any(
+                test.examples for test in tests
+            ) or bool(parser.errors)
+
+        for test in tests:
             if test.examples:
-                yield DoctestItem.from_parent(
+                yield SphinxDoctestItem.from_parent(
                     parent=self,  # type: ignore
                     name=test.name,
                     runner=runner,
                     dtest=test,
                 )
+        if parser.errors:
+            yield _invalid_directives_item(self, parser.errors)
+
+
+class SphinxDoctestExtensionModule(SphinxDoctestModule):
+    """Collect the docstrings of a module listed in ``sphinx_extension_modules``.
+
+    These are usually extension modules, whose docstrings come from C code.
+    The module is imported by its name, unless it is already loaded.  The
+    lines of the docstrings are unknown.
+    """
+
+    def _import_module(self) -> types.ModuleType:
+        name = _get_extension_modules(self.config)[self.path]
+        return sys.modules.get(name) or importlib.import_module(name)
+
+    def _get_docstring_linenos(self, module: types.ModuleType) -> dict[str, int]:
+        return {}
+
+
+def _get_extension_modules(config: pytest.Config) -> dict[Path, str]:
+    """Map the files of the ``sphinx_extension_modules`` to their names.
+
+    The files are found without importing the modules (but their parent
+    packages are imported).
+    """
+    extension_modules = config.stash.get(_EXTENSION_MODULES_KEY, None)
+    if extension_modules is None:
+        extension_modules = {}
+        for name in config.getini("sphinx_extension_modules"):
+            try:
+                spec = importlib.util.find_spec(name)
+            except ImportError:
+                spec = None
+            if spec is None or not spec.has_location or spec.origin is None:
+                raise pytest.UsageError(
+                    f"sphinx_extension_modules: cannot find the file of {name!r}"
+                )
+            extension_modules[Path(spec.origin).resolve()] = name
+        config.stash[_EXTENSION_MODULES_KEY] = extension_modules
+    return extension_modules
+
+
+def _get_stub_module_name(path: Path) -> str:
+    """Derive the name of the module of a stub file from its packages."""
+    parts = [] if path.stem == "__init__" else [path.stem]
+    package = path.parent
+    while any((package / f"__init__{suffix}").is_file() for suffix in (".py", ".pyi")):
+        parts.insert(0, package.name)
+        package = package.parent
+    return ".".join(parts)
+
+
+class SphinxDoctestStub(pytest.Module):
+    """Collect the doctest directives in the docstrings of a stub file (.pyi).
+
+    Stubs are parsed and never imported, so the examples run with globals
+    that only define ``__name__``.
+    """
+
+    obj = None
+
+    def collect(self) -> Iterator[SphinxDoctestItem | SphinxInvalidDirectivesItem]:
+        stats = self.config.stash.get(_STATS_KEY, None)
+        with _phase(stats, "read"):
+            source = importlib.util.decode_source(self.path.read_bytes())
+        with _phase(stats, "find"):
+            tree = ast.parse(source, str(self.path))
+        module_name = _get_stub_module_name(self.path)
+        runner = _get_runner(self.config)
+
+        engine = _get_scan_engine(self.config)
+
+        tests = []
+        errors: list[tuple[int, DirectiveError]] = []
+        for name, node in _iter_docstrings(tree, module_name):
+            examples, docstring_errors = _collect_examples(
+                node.value, DirectiveSyntax.RST, None, stats, engine
+            )
+            errors.extend((node.lineno - 1, error) for error in docstring_errors)
+            if examples:
+                test = doctest.DocTest(
+                    examples=examples,
+                    globs={
+                        **_get_global_namespace(self.config),
+                        "__name__": module_name,
+                    },
+                    name=name,
+                    filename=str(self.path),
+                    lineno=node.lineno - 1,
+                    docstring=node.value,
+                )
+                _set_source_linenos(test)
+                tests.append(test)
+        if stats is not None:
+            stats.counters["files"] += 1
+            stats.counters["files with directives"] += bool(tests or errors)
+
+        for test in sorted(tests):
+            yield SphinxDoctestItem.from_parent(
+                parent=self,  # type: ignore
+                name=test.name,
+                runner=runner,
+                dtest=test,
+            )
+        if errors:
+            yield _invalid_directives_item(self, errors)
+
+
+def _example_key(example: doctest.Example) -> tuple[Any, ...]:
+    """Return everything that determines the outcome of `example`."""
+    groups = getattr(example, "groups", None)
+    return (
+        example.source,
+        example.want,
+        example.exc_msg,
+        tuple(sorted(example.options.items())),
+        tuple(groups) if groups else None,
+        getattr(example, "timeout", None),
+    )
+
+
+def _first_change(old: list[doctest.Example], new: list[doctest.Example]) -> int:
+    """Return the index of the first example of `new` that differs from `old`.
+
+    The examples before it are unchanged.  Return ``len(new)`` if nothing
+    changed.  All groups of a doctest share one namespace, so every example
+    from this index on has to be run again.
+    """
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_example_key(example) for example in old],
+        [_example_key(example) for example in new],
+        autojunk=False,
+    )
+    for tag, _, _, j1, _ in matcher.get_opcodes():
+        if tag != "equal":
+            return j1
+    return len(new)
+
+
+def _get_stamps(collector: SphinxDoctestTextfile) -> dict[Path, tuple[int, int]]:
+    """Return the mtime and the size of the file and the files it includes."""
+    paths = {collector.path}
+    if collector.resolved_text is not None:
+        paths.update(path for path, _ in collector.resolved_text.origins)
+    stamps = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            stamps[path] = (0, -1)
+        else:
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+class _WatchedFile:
+    """A text file of ``--sphinx-watch`` and the examples of its last run."""
+
+    def __init__(
+        self,
+        collector: SphinxDoctestTextfile,
+        stamps: dict[Path, tuple[int, int]],
+        item: SphinxDoctestItem | None,
+    ) -> None:
+        self.collector = collector
+        self.stamps = stamps
+        self.examples: list[doctest.Example] = []
+        #: the globals before the examples, see `SphinxDoctestItem.snapshots`
+        self.snapshots: Sequence[dict[str, Any]] = ()
+        if item is not None:
+            self.examples = item.dtest.examples if item.dtest is not None else []
+            self.snapshots = item.snapshots
+
+
+class _Watcher:
+    """Re-run the examples of changed text files, see ``--sphinx-watch``.
+
+    The files are polled every `interval` seconds.  A changed file is
+    collected again and its examples are compared to the examples of the
+    last run (see `_first_change`).  The examples from the first changed
+    one on are run again, starting from a copy of the globals before it,
+    which the runner kept in the last run (see
+    `SphinxDocTestRunner.keep_snapshots`).  Without such a copy all examples
+    of the file are run.
+    """
+
+    interval = 0.5
+
+    def __init__(self, session: pytest.Session) -> None:
+        self.reporter: pytest.TerminalReporter = session.config.pluginmanager.getplugin(
+            "terminalreporter"
+        )
+        self._items = [
+            item
+            for item in session.items
+            if isinstance(item, SphinxDoctestItem)
+            and isinstance(item.parent, SphinxDoctestTextfile)
+        ]
+        # taken before the items are run, so that changes made during the
+        # run are not missed
+        self._stamps = [_get_stamps(item.parent) for item in self._items]  # type: ignore[arg-type]
+        self.files: list[_WatchedFile] = []
+
+    def run(self) -> None:
+        # the items have been run, so their snapshots are known now
+        self.files = [
+            _WatchedFile(item.parent, stamps, item)  # type: ignore[arg-type]
+            for item, stamps in zip(self._items, self._stamps, strict=True)
+        ]
+        self.reporter.write_sep(
+            "=", f"watching {len(self.files)} file(s) for changes (Ctrl+C to stop)"
+        )
+        try:
+            while True:
+                self.wait()
+                self.poll()
+        except KeyboardInterrupt:
+            self.reporter.write_line("stopped watching")
+
+    def wait(self) -> None:
+        time.sleep(self.interval)
+
+    def poll(self) -> None:
+        """Re-run the examples of the files that changed since the last poll."""
+        for watched in self.files:
+            stamps = _get_stamps(watched.collector)
+            if stamps != watched.stamps:
+                watched.stamps = stamps
+                self._rerun(watched)
+
+    def _rerun(self, watched: _WatchedFile) -> None:
+        collector = watched.collector
+        try:
+            items = list(collector.collect())
+        except Exception as e:  # e.g. an include that doesn't exist (yet)
+            self.reporter.write_line(f"{collector.nodeid}: {e}", red=True)
+            return
+        doc_items = [i for i in items if isinstance(i, SphinxDoctestItem)]
+        other_items = [i for i in items if not isinstance(i, SphinxDoctestItem)]
+        test = doc_items[0].dtest if doc_items else None
+        examples = test.examples if test is not None else []
+
+        first = _first_change(watched.examples, examples)
+        snapshots = watched.snapshots
+        if first < len(examples) and first >= len(snapshots):
+            # the globals before the first change are not known
+            first, snapshots = 0, ()
+        rerun = range(first, len(examples))
+
+        reports = []
+        run_snapshots: Sequence[dict[str, Any]] = ()
+        if test is not None and rerun:
+            item = SphinxDoctestItem.from_parent(
+                collector,  # type: ignore[arg-type]
+                name=doc_items[0].name,
+                runner=doc_items[0].runner,
+                dtest=doctest.DocTest(
+                    examples[first:],
+                    dict(snapshots[first]) if snapshots else test.globs,
+                    test.name,
+                    test.filename,
+                    test.lineno,
+                    test.docstring,
+                ),
+            )
+            reports.extend(runtestprotocol(item, log=False, nextitem=None))
+            run_snapshots = item.snapshots
+        for other_item in other_items:
+            reports.extend(runtestprotocol(other_item, log=False, nextitem=None))
+
+        for report in reports:
+            if report.failed:
+                self.reporter.write_line(report.longreprtext)
+        failed = any(report.failed for report in reports)
+        self.reporter.write_line(
+            f"{collector.nodeid}: ran {len(rerun)} of {len(examples)} example(s), "
+            + ("failed" if failed else "passed"),
+            red=failed,
+            green=not failed,
+        )
+
+        watched.examples = examples
+        watched.snapshots = [*snapshots[:first], *run_snapshots]
+
+
+def _check_docstring(
+    docstring: str, syntax: DirectiveSyntax, engine: _LineScanEngine | None = None
+) -> list[tuple[int, str]]:
+    """Check the doctest directives in `docstring` without running them.
+
+    Return the (0-based) lines and the messages of all problems that were
+    found.
+    """
+    directive_errors: list[DirectiveError] = []
+    sections = get_sections(docstring, syntax, directive_errors, engine)
+    errors = [(error.lineno, error.message) for error in directive_errors]
+    for i, section in enumerate(sections):
+        lineno = section.directive_lineno or 0
+        if section.skipif_expr:
+            try:
+                compile(section.skipif_expr, "<skipif>", "eval")
+            except SyntaxError as e:
+                errors.append((lineno, f"invalid :skipif: expression: {e.msg}"))
+        if section.directive != SphinxDoctestDirectives.TESTCODE:
+            continue
+        try:
+            compile(section.body, "<testcode>", "exec", ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+        except SyntaxError as e:
+            errors.append(
+                (lineno, f"invalid syntax in line {e.lineno} of testcode: {e.msg}")
+            )
+        # skipif expressions are not evaluated, but testoutput sections with
+        # a skipif expression may be skipped
+        unskipped = [
+            s
+            for s in _get_next_textoutputsections(sections, i + 1)
+            if not s.skipif_expr
+        ]
+        if len(unskipped) > 1:
+            errors.append((lineno, "There are multiple unskipped TESTOUTPUT sections"))
+    return errors
+
+
+def check_file(
+    path: Path, encoding: str = "utf-8", scan_engine: str = "line"
+) -> list[str]:
+    """Check the doctest directives of a file without running them.
+
+    Neither modules are imported nor examples are run: python files are
+    parsed, the directives are split into their options and bodies and the
+    testcode bodies are compiled.  Return the problems as
+    ``"path:line: message"`` strings.  `scan_engine` is the name of the
+    engine that finds the directives (see ``sphinx_scan_engine``).
+    """
+    if path.suffix in (".py", ".pyi"):
+        source = importlib.util.decode_source(path.read_bytes())
+        try:
+            tree = ast.parse(source, str(path))
+        except SyntaxError as e:
+            return [f"{path}:{e.lineno}: {e.msg}"]
+        docstrings = [
+            (node.lineno - 1, node.value) for _, node in _iter_docstrings(tree, "")
+        ]
+    elif path.suffix == ".ipynb":
+        docstrings = [(0, _join_notebook_cells(path)[0])]
+    else:
+        docstrings = [(0, path.read_text(encoding))]
+
+    syntax = _FILE_EXTENSION_TO_SYNTAX.get(path.suffix, DirectiveSyntax.RST)
+    return [
+        f"{path}:{offset + lineno + 1}: {message}"
+        for offset, docstring in docstrings
+        for lineno, message in _check_docstring(
+            docstring, syntax, _SCAN_ENGINES[scan_engine]
+        )
+    ]
+
+
+class SphinxCheckError(Exception):
+    """Raised by items for files with invalid doctest directives."""
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__(errors)
+        self.errors = errors
+
+
+class SphinxCheckFile(pytest.File):
+    """Collector of the file checks of ``--sphinx-check-only``."""
+
+    def collect(self) -> Iterator[SphinxCheckItem]:
+        yield SphinxCheckItem.from_parent(self, name=self.path.name)
+
+
+class SphinxInvalidDirectivesItem(pytest.Item):
+    """Item that fails with all the malformed directives of a file.
+
+    The valid examples of the file are still collected and run.
+    """
+
+    def __init__(self, *, errors: list[str] | None = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.errors = errors or []
+
+    def runtest(self) -> None:
+        raise SphinxCheckError(self.errors)
+
+    def repr_failure(  # type: ignore[override]
+        self, excinfo: pytest.ExceptionInfo[BaseException]
+    ) -> str | TerminalRepr:
+        if isinstance(excinfo.value, SphinxCheckError):
+            return "\n".join(excinfo.value.errors)
+        return super().repr_failure(excinfo)
+
+    def reportinfo(self) -> tuple[Path, int | None, str]:
+        return self.path, None, f"[sphinx] {self.name}"
+
+
+class SphinxCheckItem(SphinxInvalidDirectivesItem):
+    def runtest(self) -> None:
+        errors = check_file(
+            self.path,
+            self.config.getini("doctest_encoding"),
+            self.config.getini("sphinx_scan_engine"),
+        )
+        if errors:
+            raise SphinxCheckError(errors)
+
+    def reportinfo(self) -> tuple[Path, int | None, str]:
+        return self.path, None, f"[sphinx-check] {self.name}"
+
+
+def _iter_doc_files(paths: list[Path]) -> Iterator[Path]:
+    suffixes = (*_FILE_EXTENSION_TO_SYNTAX, ".pyi")
+    for path in paths:
+        if path.is_dir():
+            for child in sorted(path.rglob("*")):
+                relative_parts = child.relative_to(path).parts
+                if (
+                    child.suffix in suffixes
+                    and child.is_file()
+                    and not any(part.startswith(".") for part in relative_parts)
+                ):
+                    yield child
+        else:
+            yield path
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Check the doctest directives of files without running them.
+
+    This is the entry point of the ``pytest-sphinx-check`` script.
+    """
+    parser = argparse.ArgumentParser(
+        prog="pytest-sphinx-check",
+        description="Check that the sphinx doctest directives of the given files "
+        "(or of the files in the given directories) can be parsed and that their "
+        "code compiles. Nothing is imported or run.",
+    )
+    parser.add_argument("paths", nargs="+", type=Path, metavar="path")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--encoding", default="utf-8", help="encoding of text files (default: utf-8)"
+    )
+    parser.add_argument(
+        "--scan-engine",
+        choices=tuple(_SCAN_ENGINES),
+        default="line",
+        help="how the lines with directives are found (default: line)",
+    )
+    args = parser.parse_args(argv)
+
+    files = list(_iter_doc_files(args.paths))
+    encodings = [args.encoding] * len(files)
+    scan_engines = [args.scan_engine] * len(files)
+    if args.jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = list(
+                pool.map(check_file, files, encodings, scan_engines, chunksize=16)
+            )
+    else:
+        results = list(map(check_file, files, encodings, scan_engines))
+
+    errors = [error for result in results for error in result]
+    for error in errors:
+        print(error)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import pytest
+from _pytest.pytester import Pytester
+
+from pytest_sphinx import check_file
+from pytest_sphinx import main
+
+INVALID_DOC = """
+.. testcode::
+
+    def f(:
+        pass
+
+.. testcode::
+    :skipif: 1 +
+
+    print(1)
+
+.. testoutput::
+
+    1
+
+.. testoutput::
+
+    1
+"""
+
+
+def test_check_file(tmp_path: Path) -> None:
+    path = tmp_path / "doc.rst"
+    path.write_text(INVALID_DOC)
+    assert check_file(path) == [
+        f"{path}:2: invalid syntax in line 1 of testcode: invalid syntax",
+        f"{path}:7: invalid :skipif: expression: invalid syntax",
+        f"{path}:7: There are multiple unskipped TESTOUTPUT sections",
+    ]
+
+
+def test_check_file_does_not_import_modules(tmp_path: Path) -> None:
+    path = tmp_path / "mod.py"
+    path.write_text(
+        '''
+raise RuntimeError("imported")
+
+
+def func():
+    """
+    .. testcode::
+
+        print(
+    """
+'''
+    )
+    assert check_file(path) == [
+        f"{path}:7: invalid syntax in line 1 of testcode: '(' was never closed"
+    ]
+
+
+def test_check_file_top_level_await(tmp_path: Path) -> None:
+    path = tmp_path / "doc.md"
+    path.write_text(
+        """
+```{testcode}
+await asyncio.sleep(0)
+```
+"""
+    )
+    assert check_file(path) == []
+
+
+def test_main(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    (tmp_path / "good.rst").write_text(".. testcode::\n\n    pass\n")
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / ".hidden" / "bad.rst").write_text(INVALID_DOC)
+    assert main([str(tmp_path), "-j", "2"]) == 0
+
+    (tmp_path / "bad.rst").write_text(INVALID_DOC)
+    assert main([str(tmp_path), "-j", "2"]) == 1
+    out = capsys.readouterr().out.splitlines()
+    assert len(out) == 3
+    assert all(line.startswith(f"{tmp_path / 'bad.rst'}:") for line in out)
+
+
+def test_check_only_option(pytester: Pytester) -> None:
+    pytester.maketxtfile(
+        test_good="""
+        .. testcode::
+
+            raise RuntimeError("not executed")
+        """,
+        test_bad=INVALID_DOC,
+    )
+    pytester.makepyfile(test_other="def test_other(): raise RuntimeError")
+
+    result = pytester.runpytest("--sphinx-check-only")
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_bad.txt:1: invalid syntax in line 1 of testcode*",
+            "*test_bad.txt:6: invalid :skipif: expression*",
+        ]
+    )
+
+
+def test_check_only_option_does_not_import_modules(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        mod='''
+        raise RuntimeError("imported")
+
+
+        def f():
+            """
+            .. testcode::
+
+                print(1)
+            """
+        ''',
+        test_mod="raise RuntimeError('imported')",
+    )
+
+    result = pytester.runpytest("--sphinx-check-only", "--doctest-modules")
+    # both files are checked, but neither is imported
+    result.assert_outcomes(passed=2)
+    result.stdout.no_fnmatch_line("*imported*")
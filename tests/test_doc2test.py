@@ -1,9 +1,12 @@
 import doctest
 import os
 import textwrap
+from pathlib import Path
 
 import pytest
 
+from pytest_sphinx import _SCAN_ENGINES
+from pytest_sphinx import DirectiveError
 from pytest_sphinx import DirectiveSyntax
 from pytest_sphinx import docstring2examples
 from pytest_sphinx import get_sections
@@ -95,3 +98,202 @@ def test_cartopy() -> None:
 
     assert len(sections) == 9
     assert sections[0].groups == ["countries"]
+
+
+def test_myst_nested_fences() -> None:
+    doc = """
+````{testcode}
+print('```')
+print('```python')
+````
+
+````{testoutput}
+```
+```python
+````
+"""
+
+    examples = docstring2examples(doc, syntax=DirectiveSyntax.MYST)
+    assert len(examples) == 1
+    assert examples[0].source == "print('```')\nprint('```python')\n"
+    assert examples[0].want == "```\n```python\n"
+    assert examples[0].lineno == 3
+
+
+def test_myst_colon_fences() -> None:
+    doc = """
+::::{note}
+Some text
+
+:::{testcode} group
+print(1)
+:::
+
+```{testoutput} group
+1
+```
+::::
+
+```{testcode}
+print(2)
+```
+"""
+
+    sections = get_sections(doc, syntax=DirectiveSyntax.MYST)
+    assert [(s.directive.name, s.groups, s.body) for s in sections] == [
+        ("TESTCODE", ["group"], "print(1)"),
+        ("TESTOUTPUT", ["group"], "1"),
+        ("TESTCODE", ["default"], "print(2)"),
+    ]
+
+
+def test_myst_directives_in_code_blocks_are_ignored() -> None:
+    doc = """
+````markdown
+```{testcode}
+print(1)
+```
+````
+"""
+
+    assert get_sections(doc, syntax=DirectiveSyntax.MYST) == []
+
+
+@pytest.mark.parametrize("directive", ["code-block", "code", "sourcecode"])
+def test_myst_directives_in_code_directives_are_ignored(directive: str) -> None:
+    doc = f"""
+````{{{directive}}} markdown
+```{{testcode}}
+print(1)
+```
+````
+
+```{{testcode}}
+print(2)
+```
+"""
+
+    sections = get_sections(doc, syntax=DirectiveSyntax.MYST)
+    assert [s.body for s in sections] == ["print(2)"]
+
+
+def test_myst_yaml_option_block() -> None:
+    doc = """
+```{testcode}
+---
+skipif: False
+hide: true
+---
+print('abcdefgh')
+```
+
+```{testoutput}
+---
+options: "+ELLIPSIS, +NORMALIZE_WHITESPACE"
+---
+ab...gh
+```
+"""
+
+    examples = docstring2examples(doc, syntax=DirectiveSyntax.MYST)
+    assert len(examples) == 1
+    assert examples[0].source == "print('abcdefgh')\n"
+    assert examples[0].want == "ab...gh\n"
+    assert examples[0].options == {
+        doctest.ELLIPSIS: True,
+        doctest.NORMALIZE_WHITESPACE: True,
+    }
+
+
+def test_collect_all_directive_errors() -> None:
+    doc = """
+.. testcode::
+
+.. testcode::
+
+    print(1)
+
+.. testoutput::
+
+    1
+
+.. testoutput::
+
+    1
+
+.. testoutput::
+    :timeout: 1
+
+    1
+
+.. testcode::
+
+    print(2)
+"""
+
+    with pytest.raises(DirectiveError, match="no code/output"):
+        docstring2examples(doc)
+
+    errors: list[DirectiveError] = []
+    examples = docstring2examples(doc, errors=errors)
+    assert [(error.lineno, error.message) for error in errors] == [
+        (1, "no code/output"),
+        (15, ":timeout: not allowed in SphinxDoctestDirectives.TESTOUTPUT"),
+        (3, "There are multiple unskipped TESTOUTPUT sections"),
+    ]
+    assert [example.source for example in examples] == ["print(2)\n"]
+
+
+_NESTED_MYST = """
+::::{note}
+Some text
+
+:::{testcode} group
+print(1)
+:::
+
+```{testoutput} group
+1
+```
+::::
+
+````markdown
+```{testcode}
+print(1)
+```
+````
+
+```{testcode}
+print(2)
+```
+"""
+
+
+@pytest.mark.parametrize(
+    ("doc", "syntax"),
+    [
+        (
+            Path(__file__).parent / "testdata" / "using_the_shapereader.rst",
+            DirectiveSyntax.RST,
+        ),
+        (_NESTED_MYST, DirectiveSyntax.MYST),
+        (
+            "\r\n.. testcode::\r\n\r\n    print(1)\r\n\f.. testcode::\r\n\r\n  x",
+            DirectiveSyntax.RST,
+        ),
+    ],
+)
+def test_scan_engines_find_the_same_sections(
+    doc: str | Path, syntax: DirectiveSyntax
+) -> None:
+    if isinstance(doc, Path):
+        doc = doc.read_text()
+
+    def describe(engine: str) -> list[tuple[str, int, int | None, str]]:
+        sections = get_sections(doc, syntax, engine=_SCAN_ENGINES[engine])
+        return [
+            (s.directive.name, s.lineno, s.directive_lineno, s.body) for s in sections
+        ]
+
+    assert describe("buffer") == describe("line")
+    assert describe("line")
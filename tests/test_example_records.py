@@ -0,0 +1,103 @@
+import html
+import json
+import re
+
+from _pytest.pytester import Pytester
+
+DOC = """
+    .. testcode:: first
+
+        import time
+        time.sleep(0.2)
+
+    .. testcode::
+
+        x = 1
+
+    .. testoutput::
+        :skipif: True
+
+        2
+
+    .. testcode::
+
+        print(3)
+
+    .. testoutput::
+        :options: +SKIP
+
+        3
+
+    .. testcode::
+        :skipif: True
+
+        raise AssertionError("skipped")
+
+    .. testcode::
+
+        print(4)
+
+    .. testoutput::
+
+        5
+
+    .. testcode::
+
+        raise AssertionError("not reached")
+"""
+
+
+def test_example_report(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+
+    result = pytester.runpytest("--sphinx-example-report=examples.jsonl")
+    result.assert_outcomes(failed=1)
+    records = [
+        json.loads(line)
+        for line in (pytester.path / "examples.jsonl").read_text().splitlines()
+    ]
+    assert [
+        (r["nodeid"], r["file"], r["lineno"], r["groups"], r["outcome"], r["skipif"])
+        for r in records
+    ] == [
+        ("test_something.txt::test_something.txt", "test_something.txt", 5,
+         ["first"], "passed", False),
+        ("test_something.txt::test_something.txt", "test_something.txt", 9,
+         ["default"], "passed", True),
+        ("test_something.txt::test_something.txt", "test_something.txt", 18,
+         ["default"], "skipped", False),
+        ("test_something.txt::test_something.txt", "test_something.txt", 28,
+         ["default"], "skipped", True),
+        ("test_something.txt::test_something.txt", "test_something.txt", 32,
+         ["default"], "failed", False),
+    ]  # fmt: skip
+    assert records[0]["duration"] >= 0.2
+    assert records[2]["duration"] == 0
+
+
+def test_example_records_in_junitxml(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+
+    pytester.runpytest("--sphinx-example-records", "--junitxml=junit.xml")
+    junit = (pytester.path / "junit.xml").read_text()
+    records = [
+        json.loads(html.unescape(value))
+        for value in re.findall(
+            r'<property name="sphinx_example" value="(.*?)" />', junit
+        )
+    ]
+    assert [r["outcome"] for r in records] == [
+        "passed",
+        "passed",
+        "skipped",
+        "skipped",
+        "failed",
+    ]
+    assert not (pytester.path / "examples.jsonl").exists()
+
+
+def test_no_example_records_by_default(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+
+    pytester.runpytest("--junitxml=junit.xml")
+    assert "sphinx_example" not in (pytester.path / "junit.xml").read_text()
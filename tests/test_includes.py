@@ -0,0 +1,133 @@
+from _pytest.pytester import Pytester
+
+FRAGMENT = """
+.. testcode::
+
+    import pathlib
+
+    with pathlib.Path("runs.log").open("a") as f:
+        f.write("fragment\\n")
+    value = 42
+"""
+
+PAGE = """
+{title}
+
+.. include:: {include}
+
+.. testcode::
+
+    print(value)
+
+.. testoutput::
+
+    42
+"""
+
+
+def _runs(pytester: Pytester) -> int:
+    return len((pytester.path / "runs.log").read_text().splitlines())
+
+
+def _make_docs(pytester: Pytester, ini: str = "") -> None:
+    docs = pytester.mkdir("docs")
+    (docs / "_fragment.rst").write_text(FRAGMENT)
+    (docs / "test_page1.rst").write_text(
+        PAGE.format(title="Page 1", include="_fragment.rst")
+    )
+    # absolute includes are relative to the directory of conf.py
+    (docs / "sub").mkdir()
+    (docs / "sub" / "test_page2.rst").write_text(
+        PAGE.format(title="Page 2", include="/_fragment.rst")
+    )
+    (docs / "conf.py").write_text("")
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_conf = docs/conf.py
+        addopts = --doctest-glob=*.rst
+        """
+        + ini
+    )
+
+
+def test_includes_are_resolved(pytester: Pytester) -> None:
+    _make_docs(pytester)
+
+    result = pytester.runpytest("docs/test_page1.rst", "docs/sub/test_page2.rst")
+    result.assert_outcomes(passed=2)
+    assert _runs(pytester) == 2
+
+
+def test_included_fragments_run_once(pytester: Pytester) -> None:
+    _make_docs(pytester, "sphinx_dedup_includes = true")
+
+    result = pytester.runpytest("-v", "docs")
+    result.stdout.fnmatch_lines(
+        [
+            "docs/_fragment.rst::_fragment.rst PASSED*",
+            "docs/sub/test_page2.rst::test_page2.rst PASSED*",
+            "docs/test_page1.rst::test_page1.rst PASSED*",
+        ]
+    )
+    assert _runs(pytester) == 1
+
+
+def test_failures_point_to_the_included_file(pytester: Pytester) -> None:
+    pytester.makefile(".rst", _fragment="\n.. testcode::\n\n    1 / 0\n")
+    pytester.makefile(
+        ".rst",
+        test_page="""
+        Title
+
+        .. include:: _fragment.rst
+
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            2
+        """,
+    )
+
+    result = pytester.runpytest("test_page.rst")
+    result.stdout.fnmatch_lines(
+        ["test_page.rst:6: UnexpectedException (included from _fragment.rst, line 4)"]
+    )
+
+    # the lines of the including file are not shifted by the include
+    pytester.makefile(".rst", _fragment="\n.. testcode::\n\n    1 / 1\n")
+    result = pytester.runpytest("test_page.rst")
+    result.stdout.fnmatch_lines(["test_page.rst:8: DocTestFailure"])
+
+
+def test_included_fragments_keep_the_fixtures_of_the_item(
+    pytester: Pytester,
+) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_dedup_includes = true
+        addopts = --doctest-glob=*.rst
+        """
+    )
+    pytester.makefile(".inc", frag="\n.. testcode::\n\n    value = 42\n")
+    page = """
+        Title
+
+        .. include:: frag.inc
+
+        .. testcode::
+
+            print(getfixture("tmp_path").is_dir(), value)
+
+        .. testoutput::
+
+            True 42
+        """
+    pytester.makefile(".rst", p1=page, p2=page)
+
+    result = pytester.runpytest("p1.rst", "p2.rst")
+    result.assert_outcomes(passed=2)
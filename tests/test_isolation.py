@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from _pytest.pytester import Pytester
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+
+
+def _make_docs(pytester: Pytester) -> None:
+    pytester.makefile(
+        ".txt",
+        test_a_pollute="""
+        .. testcode::
+
+            import sys
+
+            sys.path.append("polluted")
+    """,
+        test_b_check="""
+        .. testcode::
+
+            import sys
+
+            print("polluted" in sys.path)
+
+        .. testoutput::
+
+            False
+    """,
+    )
+
+
+def test_isolate(pytester: Pytester) -> None:
+    _make_docs(pytester)
+
+    result = pytester.runpytest_subprocess()
+    result.assert_outcomes(passed=1, failed=1)
+
+    result = pytester.runpytest_subprocess("--sphinx-isolate")
+    result.assert_outcomes(passed=2)
+
+
+def test_isolate_ini(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_isolate = *_pollute.txt
+    """
+    )
+    _make_docs(pytester)
+
+    result = pytester.runpytest_subprocess()
+    result.assert_outcomes(passed=2)
+
+
+def test_isolated_failures_and_crashes(pytester: Pytester) -> None:
+    pytester.makefile(
+        ".txt",
+        test_crash="""
+        .. testcode::
+
+            import os
+
+            os._exit(3)
+    """,
+        test_fail="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            2
+    """,
+    )
+
+    result = pytester.runpytest_subprocess("--sphinx-isolate")
+    result.stdout.fnmatch_lines(
+        [
+            "*doc item crashed the isolated process (exit status 3)",
+            "Expected:",
+            "    2",
+            "Got:",
+            "    1",
+            "*=== 2 failed in *",
+        ]
+    )
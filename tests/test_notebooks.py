@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from _pytest.pytester import Pytester
+
+import pytest_sphinx
+
+
+def _make_notebook(pytester: Pytester, expected: str) -> None:
+    cells = [
+        {
+            "cell_type": "markdown",
+            "metadata": {},
+            "source": ["# Title\n", "\n", "```{testcode}\n", "x = 2\n", "```\n"],
+        },
+        {
+            "cell_type": "code",
+            "execution_count": 1,
+            "metadata": {},
+            "outputs": [
+                {
+                    "data": {"image/png": "iVBORw0KGgo=" * 1000},
+                    "metadata": {},
+                    "output_type": "display_data",
+                }
+            ],
+            "source": ["```{testcode}\n", "raise RuntimeError\n", "```\n"],
+        },
+        {
+            "cell_type": "markdown",
+            "metadata": {},
+            "source": (
+                f"Text\n\n```{{testcode}}\nprint(x + 1)\n```\n\n"
+                f"```{{testoutput}}\n{expected}\n```\n"
+            ),
+        },
+    ]
+    notebook = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+    pytester.path.joinpath("test_notebook.ipynb").write_text(json.dumps(notebook))
+
+
+@pytest.fixture(params=["ijson", "json"])
+def json_module(
+    request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    if request.param == "ijson":
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(pytest_sphinx, "ijson", None)
+
+
+@pytest.mark.usefixtures("json_module")
+def test_notebook(pytester: Pytester) -> None:
+    _make_notebook(pytester, expected="3")
+
+    result = pytester.runpytest("test_notebook.ipynb")
+    result.stdout.fnmatch_lines(["*=== 1 passed in *"])
+
+
+@pytest.mark.usefixtures("json_module")
+def test_failure_in_notebook_refers_to_cell(pytester: Pytester) -> None:
+    _make_notebook(pytester, expected="4")
+
+    result = pytester.runpytest("test_notebook.ipynb")
+    result.stdout.fnmatch_lines(
+        [
+            "Expected:",
+            "    4",
+            "Got:",
+            "    3",
+            "test_notebook.ipynb:10: DocTestFailure (cell 2, line 4)",
+            "*=== 1 failed in *",
+        ]
+    )
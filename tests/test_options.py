@@ -80,7 +80,22 @@ def test_options_and_text() -> None:
     )
 
     ret = _split_into_body_and_options(want)
-    assert ret == ("abcedf\nabcedf", None, {4: True})
+    assert ret == ("abcedf\nabcedf", None, {4: True}, None)
+
+
+def test_timeout() -> None:
+    want = "\n:timeout: 2.5\n:options: +ELLIPSIS\n\ncode"
+
+    ret = _split_into_body_and_options(want)
+    assert ret == ("code", None, {doctest.ELLIPSIS: True}, 2.5)
+
+
+@pytest.mark.parametrize("timeout", ["", "abc", "0", "-1"])
+def test_invalid_timeout(timeout: str) -> None:
+    want = f"\n:timeout: {timeout}\n\ncode"
+
+    with pytest.raises(ValueError, match="invalid timeout"):
+        _split_into_body_and_options(want)
 
 
 @pytest.mark.parametrize("expr", ["True"])
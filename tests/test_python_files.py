@@ -1,7 +1,10 @@
+import importlib.util
 import textwrap
 
 from _pytest.legacypath import Testdir
 
+from pytest_sphinx import _get_docstring_linenos
+
 
 def test_syntax_error_in_module_doctest(testdir: Testdir) -> None:
     testdir.makepyfile(
@@ -26,6 +29,39 @@ def test_syntax_error_in_module_doctest(testdir: Testdir) -> None:
     )
 
 
+def test_invalid_directives_in_module(testdir: Testdir) -> None:
+    testdir.makepyfile(
+        textwrap.dedent(
+            """
+        def valid():
+            '''
+            .. testcode::
+
+                pass
+            '''
+
+
+        def invalid():
+            '''
+            .. testcode::
+                :options: +ELLIPSIS
+
+                print(1)
+            '''
+    """
+        )
+    )
+
+    result = testdir.runpytest("--doctest-modules")
+    result.stdout.fnmatch_lines(
+        [
+            "test_invalid_directives_in_module.py:11: "
+            ":options: not allowed in SphinxDoctestDirectives.TESTCODE",
+            "*=== 1 failed, 1 passed in *",
+        ]
+    )
+
+
 def test_failing_module_doctest(testdir: Testdir) -> None:
     testdir.makepyfile(
         textwrap.dedent(
@@ -250,3 +286,231 @@ def test_with_conftest(testdir: Testdir) -> None:
     result = testdir.runpytest("--doctest-modules")
     # 2 test passed one test in conftest.py and one in something.py
     result.stdout.fnmatch_lines(["*=== 2 passed in *"])
+
+
+def test_failing_property_and_decorated_method_doctests(testdir: Testdir) -> None:
+    testdir.makepyfile(
+        textwrap.dedent(
+            """
+        import functools
+
+        def deco(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                return func(*args)
+            return wrapper
+
+        class Spam:
+            @property
+            def prop(self):
+                '''
+                .. testcode::
+
+                    print(2+5)
+
+                .. testoutput::
+
+                    3
+                '''
+
+            @deco
+            def method(self):
+                '''
+                .. testcode::
+
+                    print(2+6)
+
+                .. testoutput::
+
+                    3
+                '''
+    """
+        )
+    )
+
+    result = testdir.runpytest("--doctest-modules")
+    assert "EXAMPLE LOCATION UNKNOWN" not in result.stdout.str()
+    result.stdout.fnmatch_lines(
+        [
+            "027*print(2+6)*",
+            "*_doctests.py:28: DocTestFailure",
+            "015*print(2+5)*",
+            "*_doctests.py:16: DocTestFailure",
+            "*=== 2 failed in *",
+        ]
+    )
+
+
+def test_docstring_linenos() -> None:
+    source = textwrap.dedent(
+        '''\
+        """Module docstring."""
+
+        class Spam:
+
+            """Class docstring."""
+
+            @property
+            def prop(self):
+                """Getter docstring."""
+
+            @prop.setter
+            def prop(self, value):
+                """Setter docstring."""
+
+            async def method(
+                self,
+                a="'",
+            ):
+
+                """Method docstring."""
+
+        def func():
+            pass
+        '''
+    )
+
+    assert _get_docstring_linenos(source, "mod") == {
+        "mod": 0,
+        "mod.Spam": 4,
+        "mod.Spam.prop": 8,
+        "mod.Spam.method": 19,
+    }
+
+
+def test_finder_finds_the_same_objects_as_doctest(testdir: Testdir) -> None:
+    testdir.makepyfile(
+        mod='''
+        import functools
+        from os.path import join
+
+        def func():
+            """
+            .. testcode::
+
+                print(1)
+
+            .. testoutput::
+
+                1
+            """
+
+        alias = func
+
+        class Spam:
+            """No directives."""
+
+            @staticmethod
+            def static():
+                """
+                .. testcode::
+
+                    pass
+                """
+
+            @classmethod
+            def cls(cls):
+                """
+                .. testcode::
+
+                    pass
+                """
+
+            class Nested:
+                """
+                .. testcode::
+
+                    pass
+                """
+
+        __test__ = {
+            "text": """
+            .. testcode::
+
+                pass
+            """,
+        }
+        '''
+    )
+
+    result = testdir.runpytest("--doctest-modules", "-v")
+    result.stdout.fnmatch_lines(
+        [
+            "mod.py::mod.Spam.Nested PASSED*",
+            "mod.py::mod.Spam.cls PASSED*",
+            "mod.py::mod.Spam.static PASSED*",
+            "mod.py::mod.__test__.text PASSED*",
+            "mod.py::mod.func PASSED*",
+            "*=== 5 passed in *",
+        ]
+    )
+
+
+def test_stub_files(testdir: Testdir) -> None:
+    pkg = testdir.mkpydir("pkg")
+    pkg.join("mod.py").write("raise RuntimeError('imported')\n")
+    pkg.join("mod.pyi").write(
+        textwrap.dedent(
+            '''
+            def func() -> None:
+                """
+                .. testcode::
+
+                    print(__name__)
+
+                .. testoutput::
+
+                    pkg.mod
+                """
+
+            class Spam:
+                def method(self) -> int:
+                    """
+                    .. testcode::
+
+                        print(1)
+
+                    .. testoutput::
+
+                        2
+                    """
+            '''
+        )
+    )
+
+    result = testdir.runpytest("--doctest-modules", "-v", "pkg/mod.pyi")
+    result.stdout.fnmatch_lines(
+        [
+            "pkg/mod.pyi::pkg.mod.Spam.method FAILED*",
+            "pkg/mod.pyi::pkg.mod.func PASSED*",
+            "*pkg/mod.pyi:19: DocTestFailure",
+            "*=== 1 failed, 1 passed in *",
+        ]
+    )
+
+
+def test_extension_modules(testdir: Testdir) -> None:
+    testdir.makeini(
+        """
+        [pytest]
+        sphinx_extension_modules =
+            math
+            ext
+        """
+    )
+    testdir.makepyfile(
+        ext='''
+        def func():
+            """
+            .. testcode::
+
+                print(1)
+            """
+        '''
+    )
+    testdir.syspathinsert()
+
+    # the examples of modules listed in sphinx_extension_modules are collected
+    # without --doctest-modules
+    result = testdir.runpytest("-v", "ext.py", importlib.util.find_spec("math").origin)
+    result.stdout.fnmatch_lines(["ext.py::ext.func FAILED*", "*=== 1 failed in *"])
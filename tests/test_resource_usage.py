@@ -0,0 +1,172 @@
+import os
+import re
+
+import pytest
+from _pytest.pytester import Pytester
+
+from pytest_sphinx import _parse_size
+
+ALLOCATING_DOC = """
+    .. testcode::
+
+        data = bytearray(20 * 1024 * 1024)
+
+    .. testcode::
+
+        print(len(data))
+
+    .. testoutput::
+
+        20971520
+"""
+
+
+@pytest.mark.parametrize(
+    ("size", "expected"),
+    [("100", 100), ("2k", 2048), ("1.5M", 1536 * 1024), ("2GB", 2 * 1024**3)],
+)
+def test_parse_size(size: str, expected: int) -> None:
+    assert _parse_size(size) == expected
+
+
+def test_resource_usage_report(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=ALLOCATING_DOC)
+
+    result = pytester.runpytest("--sphinx-resource-usage", "--junitxml=junit.xml")
+    result.stdout.fnmatch_lines(
+        [
+            "*= sphinx doctest resource usage =*",
+            "20 MiB peak memory*(worst example at line 4)  test_something.txt*",
+            "*=== 1 passed in *",
+        ]
+    )
+    junit = (pytester.path / "junit.xml").read_text()
+    properties = dict(re.findall(r'<property name="(.*?)" value="(.*?)" />', junit))
+    assert int(properties["sphinx_peak_memory"]) >= 20 * 1024 * 1024
+    assert int(properties["sphinx_peak_memory[4]"]) >= 20 * 1024 * 1024
+    assert int(properties["sphinx_peak_memory[8]"]) < 1024 * 1024
+
+
+def test_resource_usage_not_reported_by_default(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=ALLOCATING_DOC)
+
+    result = pytester.runpytest()
+    assert "resource usage" not in result.stdout.str()
+
+
+@pytest.mark.parametrize(
+    ("action", "outcome"),
+    [("warn", "1 passed, 1 warning"), ("fail", "1 failed")],
+)
+def test_memory_limit(pytester: Pytester, action: str, outcome: str) -> None:
+    pytester.makeini(
+        f"""
+        [pytest]
+        sphinx_memory_limit = 10M
+        sphinx_memory_limit_action = {action}
+    """
+    )
+    pytester.maketxtfile(test_something=ALLOCATING_DOC)
+
+    result = pytester.runpytest("--sphinx-resource-usage")
+    result.stdout.fnmatch_lines(
+        [
+            "*doctest allocated 20 MiB, which exceeds the sphinx_memory_limit of 10M"
+            " (worst example at line 4)",
+            f"*=== {outcome} in *",
+        ]
+    )
+
+
+def test_resource_usage_of_failing_items(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_memory_limit = 10M
+        sphinx_memory_limit_action = fail
+    """
+    )
+    pytester.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            data = bytearray(20 * 1024 * 1024)
+            print(len(data))
+
+        .. testoutput::
+
+            0
+    """
+    )
+
+    result = pytester.runpytest("--sphinx-resource-usage")
+    result.stdout.fnmatch_lines(
+        [
+            "*Expected:",
+            # the item fails anyway, so the limit doesn't hide its failure
+            "*doctest allocated 20 MiB, which exceeds the sphinx_memory_limit of 10M*",
+            "*= sphinx doctest resource usage =*",
+            "20 MiB peak memory*(worst example at line 5)  test_something.txt*",
+            "*=== 1 failed, 1 warning in *",
+        ]
+    )
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_resource_usage_of_isolated_items(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=ALLOCATING_DOC)
+
+    result = pytester.runpytest_subprocess(
+        "--sphinx-resource-usage", "--sphinx-isolate"
+    )
+    result.stdout.fnmatch_lines(
+        [
+            "*= sphinx doctest resource usage =*",
+            "20 MiB peak memory*(worst example at line 4)  test_something.txt*",
+            "*=== 1 passed in *",
+        ]
+    )
+
+
+def test_resource_usage_of_examples_without_lines(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        mod='''
+        __test__ = {
+            "extra": """
+        .. testcode::
+
+            data = bytearray(20 * 1024 * 1024)
+        """
+        }
+        '''
+    )
+
+    result = pytester.runpytest("--doctest-modules", "--sphinx-resource-usage")
+    result.stdout.fnmatch_lines(
+        ["*= sphinx doctest resource usage =*", "20 MiB peak memory*", "*1 passed*"]
+    )
+    result.stdout.no_fnmatch_line("*INTERNALERROR*")
+
+
+@pytest.mark.parametrize(
+    ("ini", "error"),
+    [
+        (
+            "sphinx_memory_limit_action = error",
+            "sphinx_memory_limit_action must be warn or fail, not 'error'",
+        ),
+        ("sphinx_memory_limit = lots", "sphinx_memory_limit: *"),
+    ],
+)
+def test_invalid_memory_limit(pytester: Pytester, ini: str, error: str) -> None:
+    pytester.makeini(
+        f"""
+        [pytest]
+        {ini}
+    """
+    )
+    pytester.maketxtfile(test_something=ALLOCATING_DOC)
+
+    result = pytester.runpytest("--sphinx-resource-usage")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines([f"ERROR: {error}"])
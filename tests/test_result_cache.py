@@ -0,0 +1,127 @@
+from _pytest.pytester import Pytester
+from _pytest.reports import TestReport
+
+from pytest_sphinx import _ResultCache
+
+DOC = """
+    .. testcode::
+
+        import pathlib
+
+        with pathlib.Path("runs.log").open("a") as f:
+            f.write("run\\n")
+        print({value})
+
+    .. testoutput::
+
+        {expected}
+"""
+
+
+def _runs(pytester: Pytester) -> int:
+    return len((pytester.path / "runs.log").read_text().splitlines())
+
+
+def test_passed_items_are_not_rerun(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC.format(value=1, expected=1))
+
+    result = pytester.runpytest("--sphinx-result-cache")
+    result.stdout.fnmatch_lines(["*=== 1 passed in *"])
+    assert _runs(pytester) == 1
+
+    result = pytester.runpytest("--sphinx-result-cache")
+    result.stdout.fnmatch_lines(
+        [
+            "pytest-sphinx: 1 doc item(s) passed in a previous run and were not "
+            "executed (--sphinx-result-cache)",
+            "*=== 1 passed in *",
+        ]
+    )
+    assert _runs(pytester) == 1
+
+    # the cache is only used if it is requested
+    pytester.runpytest()
+    assert _runs(pytester) == 2
+
+    # changed examples are run again
+    pytester.maketxtfile(test_something=DOC.format(value=2, expected=2))
+    pytester.runpytest("--sphinx-result-cache")
+    assert _runs(pytester) == 3
+
+
+def test_failed_items_are_rerun(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC.format(value=1, expected=2))
+
+    for runs in (1, 2):
+        result = pytester.runpytest("--sphinx-result-cache")
+        result.stdout.fnmatch_lines(["*=== 1 failed in *"])
+        assert _runs(pytester) == runs
+
+
+def test_dependencies_invalidate_the_cache(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_result_cache_dependencies =
+            pytest
+            src/*.py
+    """
+    )
+    pytester.maketxtfile(test_something=DOC.format(value=1, expected=1))
+    pytester.mkdir("src")
+    module = pytester.path / "src" / "module.py"
+    module.write_text("VALUE = 1\n")
+
+    pytester.runpytest("--sphinx-result-cache")
+    pytester.runpytest("--sphinx-result-cache")
+    assert _runs(pytester) == 1
+
+    module.write_text("VALUE = 2\n")
+    pytester.runpytest("--sphinx-result-cache")
+    assert _runs(pytester) == 2
+
+
+def test_keys_saved_by_other_processes_are_kept(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC.format(value=1, expected=1))
+    # another process (e.g. an xdist worker) saves a key during the run
+    pytester.makeconftest(
+        """
+        def pytest_runtest_call(item):
+            item.config.cache.set("sphinx/result_cache", {"other.txt": "key"})
+    """
+    )
+
+    pytester.runpytest("--sphinx-result-cache")
+    config = pytester.parseconfigure()
+    assert config.cache is not None
+    assert sorted(config.cache.get("sphinx/result_cache", {})) == [
+        "other.txt",
+        "test_something.txt::test_something.txt",
+    ]
+
+
+def test_controller_collects_the_keys_of_the_workers(pytester: Pytester) -> None:
+    config = pytester.parseconfigure("--sphinx-result-cache")
+    result_cache = _ResultCache(config)
+
+    def report(nodeid: str, *user_properties: tuple[str, object]) -> TestReport:
+        return TestReport(
+            nodeid,
+            (nodeid, None, ""),
+            {},
+            "passed",
+            None,
+            "call",
+            user_properties=user_properties,
+        )
+
+    result_cache.pytest_runtest_logreport(report("a.txt", ("sphinx_result_cache", "k")))
+    result_cache.pytest_runtest_logreport(report("b.txt", ("sphinx_cached", True)))
+    result_cache.pytest_runtest_logreport(
+        report("c.txt", ("sphinx_result_cache", None))
+    )
+    result_cache.save()
+
+    assert result_cache.hits == 1
+    assert config.cache is not None
+    assert config.cache.get("sphinx/result_cache", {}) == {"a.txt": "k"}
@@ -0,0 +1,60 @@
+import argparse
+
+import pytest
+from _pytest.pytester import Pytester
+
+from pytest_sphinx import _parse_shard
+
+DOC = """
+    .. testcode::
+
+        import time
+
+        time.sleep({seconds})
+"""
+
+
+def _make_docs(pytester: Pytester) -> None:
+    pytester.makefile(
+        ".txt",
+        test_slow=DOC.format(seconds=0.3),
+        test_fast1=DOC.format(seconds=0),
+        test_fast2=DOC.format(seconds=0),
+    )
+
+
+def _collect(pytester: Pytester, shard: str) -> list[str]:
+    result = pytester.runpytest(f"--sphinx-shard={shard}", "--collect-only", "-q")
+    return [line for line in result.outlines if "::" in line]
+
+
+@pytest.mark.parametrize("value", ["0/2", "3/2", "1", "a/b", "1/2/3"])
+def test_invalid_shard(value: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError, match="expected i/N"):
+        _parse_shard(value)
+
+
+def test_shards_cover_all_items(pytester: Pytester) -> None:
+    _make_docs(pytester)
+    pytester.makepyfile(test_other="def test_other(): pass")
+
+    first, second = _collect(pytester, "1/2"), _collect(pytester, "2/2")
+    # other tests are not sharded
+    assert "test_other.py::test_other" in first
+    assert "test_other.py::test_other" in second
+    assert sorted(set(first) ^ set(second)) == [
+        "test_fast1.txt::test_fast1.txt",
+        "test_fast2.txt::test_fast2.txt",
+        "test_slow.txt::test_slow.txt",
+    ]
+
+
+def test_shards_are_balanced_by_duration(pytester: Pytester) -> None:
+    _make_docs(pytester)
+    pytester.runpytest().assert_outcomes(passed=3)
+
+    assert _collect(pytester, "1/2") == ["test_slow.txt::test_slow.txt"]
+    assert _collect(pytester, "2/2") == [
+        "test_fast1.txt::test_fast1.txt",
+        "test_fast2.txt::test_fast2.txt",
+    ]
@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import pytest
+from _pytest.pytester import Pytester
+
+from pytest_sphinx import _read_sphinx_conf
+
+DOC = """
+    .. testcode::
+
+        print(sqrt(COUNT))
+
+    .. testoutput::
+
+        2.0
+"""
+
+
+def _make_docs(pytester: Pytester, conf: str) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_conf = docs/conf.py
+        """
+    )
+    docs = pytester.mkdir("docs")
+    (docs / "conf.py").write_text(conf)
+    pytester.maketxtfile(test_one=DOC, test_two=DOC)
+
+
+def _setup_runs(pytester: Pytester) -> list[str]:
+    return (pytester.path / "runs.log").read_text().splitlines()
+
+
+def test_global_setup_runs_once(pytester: Pytester) -> None:
+    _make_docs(
+        pytester,
+        '''
+doctest_global_setup = """
+from math import sqrt
+with open("runs.log", "a") as f:
+    f.write("setup\\\\n")
+COUNT = 4
+"""
+doctest_global_cleanup = """
+with open("runs.log", "a") as f:
+    f.write(f"cleanup {COUNT}\\\\n")
+"""
+raise RuntimeError("conf.py is not executed")
+''',
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2)
+    assert _setup_runs(pytester) == ["setup", "cleanup 4"]
+
+
+def test_dynamic_conf_is_executed(pytester: Pytester) -> None:
+    _make_docs(
+        pytester,
+        """
+doctest_global_setup = "\\n".join(["from math import sqrt", "COUNT = 4"])
+""",
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2)
+
+
+def test_read_sphinx_conf(tmp_path: Path) -> None:
+    conf = tmp_path / "conf.py"
+    conf.write_text(
+        "import sys\n"
+        "doctest_global_setup = 'import os'\n"
+        "if sys.platform:\n"
+        "    doctest_global_cleanup = 'del os'\n"
+    )
+    assert _read_sphinx_conf(conf) == {
+        "doctest_global_setup": "import os",
+        "doctest_global_cleanup": "del os",
+    }
+
+    conf.write_text("extensions = []\n")
+    assert _read_sphinx_conf(conf) == {}
+
+
+def test_missing_conf(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_conf = docs/conf.py
+        """
+    )
+    pytester.maketxtfile(test_one=DOC)
+    result = pytester.runpytest()
+    assert result.ret != pytest.ExitCode.OK
+    result.stderr.fnmatch_lines(["*sphinx_conf: *conf.py doesn't exist"])
@@ -301,5 +301,11 @@ class TestDirectives:
         sphinx_output = sphinx_tester(code, must_raise=False)
         assert "0 tests" in sphinx_output
 
-        plugin_output = testdir.runpytest("--doctest-glob=index.rst").stdout
-        plugin_output.fnmatch_lines(["collected 0 items"])
+        # the skipped example is reported as a skipped item
+        plugin_output = testdir.runpytest("--doctest-glob=index.rst", "-rs").stdout
+        plugin_output.fnmatch_lines(
+            [
+                "SKIPPED *index.rst:1: all examples are skipped (:skipif: or +SKIP)",
+                "*=== 1 skipped in *",
+            ]
+        )
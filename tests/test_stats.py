@@ -0,0 +1,59 @@
+import json
+
+from _pytest.pytester import Pytester
+
+
+def test_collection_stats(pytester: Pytester) -> None:
+    pytester.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            1
+    """,
+        test_nothing="no directives",
+    )
+    pytester.makepyfile(
+        mod='''
+        def func():
+            """
+            .. testcode::
+
+                pass
+            """
+
+
+        def other():
+            """No directives."""
+        '''
+    )
+
+    result = pytester.runpytest(
+        "--doctest-modules", "--sphinx-stats-json=stats.json", "--sphinx-stats"
+    )
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        [
+            "*= sphinx doctest collection stats =*",
+            "read *s *%  reading text files and notebooks",
+            "scan *s *%  finding directives and parsing their options",
+            "examples *",
+            "import *",
+            "find *",
+            "3 files, 2 files with directives, 3 docstrings, 3 sections, "
+            "2 examples, 1 imports",
+        ]
+    )
+
+    stats = json.loads((pytester.path / "stats.json").read_text())
+    assert set(stats["timings"]) == {"read", "scan", "examples", "import", "find"}
+    assert stats["counters"]["sections"] == 3
+
+
+def test_no_collection_stats_by_default(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something="no directives")
+    result = pytester.runpytest()
+    assert "collection stats" not in result.stdout.str()
@@ -1,4 +1,9 @@
+import doctest
+import signal
+import textwrap
+
 import _pytest.doctest
+import pytest
 from _pytest.legacypath import Testdir
 from _pytest.pytester import Pytester
 
@@ -212,6 +217,63 @@ def test_skipif_non_builtin(testdir: Testdir) -> None:
     result.stdout.fnmatch_lines(["*NameError:*name 'pd' is not defined"])
 
 
+def test_all_examples_skipped(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_skipped="""
+        .. testcode::
+            :skipif: True
+
+            raise RuntimeError
+
+        .. testcode::
+
+            raise RuntimeError
+
+        .. testoutput::
+            :options: +SKIP
+
+            NOT EVALUATED
+    """,
+        test_partly_skipped="""
+        .. testcode::
+            :skipif: True
+
+            raise RuntimeError
+
+        .. testcode::
+
+            print(sys.version_info is not None)
+
+        .. testoutput::
+
+            True
+    """,
+    )
+    testdir.makeconftest(
+        """
+        import sys
+
+        import pytest
+
+        @pytest.fixture(autouse=True)
+        def add_sys(doctest_namespace):
+            if "skipped" in doctest_namespace:
+                raise RuntimeError("set up twice")
+            doctest_namespace["skipped"] = True
+            doctest_namespace["sys"] = sys
+    """
+    )
+
+    result = testdir.runpytest("-rs")
+    # the fixtures of the skipped item are not set up
+    result.stdout.fnmatch_lines(
+        [
+            "SKIPPED *test_skipped.txt:1: all examples are skipped (:skipif: or +SKIP)",
+            "*=== 1 passed, 1 skipped in *",
+        ]
+    )
+
+
 def test_doctest_namespace(testdir: Testdir) -> None:
     testdir.maketxtfile(
         test_something="""
@@ -268,3 +330,611 @@ def test_doctest_directive(testdir: Testdir) -> None:
 
     result = testdir.runpytest()
     result.stdout.fnmatch_lines(["*=== 1 failed in *"])
+
+
+def test_runner_is_shared_between_files(pytester: Pytester) -> None:
+    pytester.makefile(
+        ".txt",
+        test_fail="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            2
+    """,
+        test_pass="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            1
+    """,
+    )
+
+    items, _ = pytester.inline_genitems()
+    assert len(items) == 2
+    assert items[0].runner is items[1].runner
+
+    result = pytester.runpytest()
+    result.stdout.fnmatch_lines(["*=== 1 failed, 1 passed in *"])
+
+
+def test_failing_options_dont_leak_into_other_files(pytester: Pytester) -> None:
+    pytester.makefile(
+        ".txt",
+        test_a="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+            :options: +NORMALIZE_WHITESPACE
+
+            2
+    """,
+        test_b="""
+        .. testcode::
+
+            print("a    b")
+
+        .. testoutput::
+
+            a b
+    """,
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(failed=2)
+
+
+def test_top_level_await(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            import asyncio
+
+            await asyncio.sleep(0)
+            loop = asyncio.get_running_loop()
+            print("slept")
+
+        .. testoutput::
+
+            slept
+
+        .. testcode::
+
+            await asyncio.sleep(0)
+            assert asyncio.get_running_loop() is loop
+
+        .. testcode::
+
+            async def is_same_loop():
+                return asyncio.get_running_loop() is loop
+
+            print(await is_same_loop())
+
+        .. testoutput::
+
+            True
+    """
+    )
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*=== 1 passed in *"])
+
+
+@pytest.mark.parametrize(
+    ("scope", "same_loop"), [("doctest", False), ("session", True)]
+)
+def test_event_loop_scope(testdir: Testdir, scope: str, same_loop: bool) -> None:
+    testdir.makeini(
+        f"""
+        [pytest]
+        sphinx_event_loop_scope = {scope}
+    """
+    )
+    testdir.makefile(
+        ".txt",
+        test_a="""
+        .. testcode::
+
+            import asyncio
+            import builtins
+
+            await asyncio.sleep(0)
+            builtins.first_loop = asyncio.get_running_loop()
+    """,
+        test_b=f"""
+        .. testcode::
+
+            import asyncio
+
+            await asyncio.sleep(0)
+            print(asyncio.get_running_loop() is first_loop)
+
+        .. testoutput::
+
+            {same_loop}
+    """,
+    )
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*=== 2 passed in *"])
+
+
+def test_group_workers(testdir: Testdir) -> None:
+    testdir.makeconftest(
+        """
+        import threading
+
+        import pytest
+
+        @pytest.fixture(autouse=True)
+        def add_barrier(doctest_namespace):
+            doctest_namespace["barrier"] = threading.Barrier(2, timeout=2)
+        """
+    )
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode:: first
+
+            value = 1
+            barrier.wait()
+            print(value)
+
+        .. testoutput:: first
+
+            1
+
+        .. testcode:: second
+
+            value = 2
+            barrier.wait()
+            print(value)
+
+        .. testoutput:: second
+
+            2
+
+        .. testcode:: second
+
+            print(value + 1)
+
+        .. testoutput:: second
+
+            3
+    """
+    )
+
+    result = testdir.runpytest("--sphinx-group-workers=2")
+    result.stdout.fnmatch_lines(["*=== 1 passed in *"])
+
+    # the barrier can only be passed if both groups are run concurrently
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*BrokenBarrierError*", "*=== 1 failed in *"])
+
+
+def test_timeout(testdir: Testdir) -> None:
+    testdir.makeini(
+        """
+        [pytest]
+        sphinx_timeout = 30
+    """
+    )
+    testdir.makefile(
+        ".txt",
+        test_hangs="""
+        .. testcode::
+
+            import time
+
+        .. testcode::
+            :timeout: 0.1
+
+            time.sleep(30)
+
+        .. testcode::
+
+            raise RuntimeError("not reached")
+    """,
+        test_other="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            1
+    """,
+    )
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(
+        [
+            "*ExampleTimeout: example exceeded the timeout of 0.1s (test_hangs.txt:*)",
+            "*=== 1 failed, 1 passed in *",
+        ]
+    )
+    assert "not reached" not in result.stdout.str()
+
+
+def test_timeout_not_swallowed_by_except_exception(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_retry="""
+        .. testcode::
+            :timeout: 0.1
+
+            import time
+
+            for attempt in range(300):
+                try:
+                    time.sleep(0.1)
+                except Exception:
+                    pass
+            print("finished")
+
+        .. testoutput::
+
+            finished
+    """
+    )
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(
+        ["*ExampleTimeout: example exceeded the timeout of 0.1s*", "*=== 1 failed in *"]
+    )
+    assert result.duration < 10
+
+
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="requires setitimer")
+def test_timeout_keeps_an_outer_timer(testdir: Testdir) -> None:
+    # e.g. the timer of pytest-timeout
+    testdir.makeconftest(
+        """
+        import signal
+
+        import pytest
+
+        @pytest.fixture(autouse=True)
+        def outer_timer(doctest_namespace):
+            signal.setitimer(signal.ITIMER_REAL, 100)
+            yield
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        """
+    )
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode::
+            :timeout: 5
+
+            pass
+
+        .. testcode::
+
+            import signal
+
+            print(95 < signal.getitimer(signal.ITIMER_REAL)[0] < 100)
+
+        .. testoutput::
+
+            True
+    """
+    )
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*=== 1 passed in *"])
+
+
+def test_timeout_in_worker_threads_warns(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode:: first
+            :timeout: 5
+
+            pass
+
+        .. testcode:: second
+
+            pass
+    """
+    )
+
+    result = testdir.runpytest("--sphinx-group-workers=2")
+    result.stdout.fnmatch_lines(
+        [
+            "*PytestWarning: the timeout of 5.0s of the example at "
+            "test_something.txt:* cannot be enforced: the example doesn't run in "
+            "the main thread (--sphinx-group-workers)",
+            "*=== 1 passed, 1 warning in *",
+        ]
+    )
+
+
+def test_early_mismatch(testdir: Testdir) -> None:
+    testdir.makefile(
+        ".txt",
+        test_slow="""
+        .. testcode::
+
+            for step in range(3):
+                print("step", step)
+            open("reached", "w").close()
+            print("done")
+
+        .. testoutput::
+
+            step 0
+            step 2
+            done
+    """,
+        test_fast="""
+        .. testcode::
+
+            print("a  b")
+            print("c", end="")
+            print(" d")
+
+        .. testoutput::
+            :options: +NORMALIZE_WHITESPACE
+
+            a b c d
+    """,
+    )
+
+    result = testdir.runpytest("--sphinx-early-mismatch")
+    result.stdout.fnmatch_lines(
+        [
+            "     step 0",
+            "    -step 2",
+            "    -done",
+            "    +step 1",
+            "    +[[]aborted: the output cannot match anymore]",
+            "*=== 1 failed, 1 passed in *",
+        ]
+    )
+    # the example was aborted after the second step
+    assert not testdir.tmpdir.join("reached").exists()
+
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*=== 1 failed, 1 passed in *"])
+    assert "aborted" not in result.stdout.str()
+
+
+def test_scan_engine(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            2
+    """
+    )
+    testdir.makeini(
+        """
+        [pytest]
+        sphinx_scan_engine = buffer
+    """
+    )
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(["*=== 1 failed in *"])
+
+    testdir.makeini(
+        """
+        [pytest]
+        sphinx_scan_engine = regex
+    """
+    )
+    result = testdir.runpytest()
+    result.stderr.fnmatch_lines(
+        ["*sphinx_scan_engine must be one of ('line', 'buffer'), not 'regex'"]
+    )
+
+
+@pytest.mark.parametrize(
+    ("want", "options", "chunks", "matches"),
+    [
+        ("a\nb\n", "", ["a\n", "b", "\n"], True),
+        ("a\nb\n", "", ["a\nc"], True),
+        ("a\nb\n", "", ["a\nc\n"], False),
+        ("a\nb\n", "", ["a\nb\nc\n"], False),
+        ("a\n<BLANKLINE>\nb\n", "", ["a\n  \n", "b\n"], True),
+        ("a\n...\n", "+ELLIPSIS", ["a\n", "x\ny\n"], True),
+        ("ab...\n", "+ELLIPSIS", ["abc\n"], True),
+        ("ab...\n", "+ELLIPSIS", ["ac\n"], False),
+        ("a b\nc\n", "+NORMALIZE_WHITESPACE", ["a", "   b c", "\n"], True),
+        ("a b\nc\n", "+NORMALIZE_WHITESPACE", ["a", "b"], False),
+        ("a b\n", "+NORMALIZE_WHITESPACE", ["a b c"], False),
+        ("a ...\n", "+NORMALIZE_WHITESPACE +ELLIPSIS", ["a", " b c d"], True),
+    ],
+)
+def test_output_prefix_check(
+    want: str, options: str, chunks: list[str], matches: bool
+) -> None:
+    optionflags = 0
+    for option in options.split():
+        optionflags |= doctest.OPTIONFLAGS_BY_NAME[option[1:]]
+    check = pytest_sphinx._OutputPrefixCheck(want, optionflags)
+    assert all([check.feed(chunk) for chunk in chunks]) is matches
+
+
+def test_invalid_directives_dont_hide_valid_examples(testdir: Testdir) -> None:
+    testdir.maketxtfile(
+        test_something="""
+        .. testcode::
+
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            1
+
+        .. testoutput::
+            :timeout: 1
+
+            1
+    """,
+    )
+
+    result = testdir.runpytest("-v")
+    result.stdout.fnmatch_lines(
+        [
+            "*test_something.txt::test_something.txt PASSED*",
+            "*test_something.txt::test_something.txt[[]invalid-directives[]] FAILED*",
+            "test_something.txt:1: no code/output",
+            "test_something.txt:11: :timeout: not allowed in *TESTOUTPUT",
+            "*=== 1 failed, 1 passed in *",
+        ]
+    )
+
+
+def test_large_outputs_are_spilled(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_report_max_size = 20
+        """
+    )
+    pytester.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            print("x" * 100)
+
+        .. testoutput::
+
+            y
+    """,
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        ["    xxxxxxxxxxxxxxxxxxxx", "    ... [[]81 more characters, full output in *]"]
+    )
+    assert "x" * 21 not in result.stdout.str()
+
+    (spill_file,) = (pytester.path / ".pytest_cache" / "d" / "sphinx-spill").iterdir()
+    assert spill_file.read_text() == (
+        "--- expected (2 characters)\ny\n\n--- got (101 characters)\n"
+        + "x" * 100
+        + "\n"
+    )
+
+
+def test_spill_files_of_files_with_the_same_name(pytester: Pytester) -> None:
+    pytester.makeini(
+        """
+        [pytest]
+        sphinx_report_max_size = 20
+        """
+    )
+    for directory in ("a", "b"):
+        pytester.mkdir(directory)
+        (pytester.path / directory / "test_something.txt").write_text(
+            textwrap.dedent(
+                f"""
+                .. testcode::
+
+                    print("{directory}" * 100)
+
+                .. testoutput::
+
+                    y
+                """
+            )
+        )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(failed=2)
+    spill_files = sorted(
+        (pytester.path / ".pytest_cache" / "d" / "sphinx-spill").iterdir()
+    )
+    assert len(spill_files) == 2
+    for spill_file in spill_files:
+        assert f"full output in {spill_file}]" in result.stdout.str()
+    assert sorted(spill_file.read_text()[-2] for spill_file in spill_files) == [
+        "a",
+        "b",
+    ]
+
+
+def test_large_outputs_are_diffed_partially(
+    pytester: Pytester, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(pytest_sphinx, "_LARGE_OUTPUT_SIZE", 100)
+    expected = "\n".join(f"            {i}" for i in range(50))
+    pytester.maketxtfile(
+        test_something=f"""
+        .. testcode::
+
+            for i in range(50):
+                print(i if i != 20 else "twenty")
+
+        .. testoutput::
+
+{expected}
+    """,
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "Expected and got differ (50 and 50 lines, only a part of the diff is "
+            "shown):",
+            "    --- expected",
+            "    +++ got",
+            "    @@ -18,7 +18,7 @@",
+            "     17",
+            "     18",
+            "     19",
+            "    -20",
+            "    +twenty",
+            "     21",
+            "     22",
+            "     23",
+            "",
+        ]
+    )
+
+
+def test_diffs_of_xfailed_items_are_not_computed(
+    pytester: Pytester, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def output_difference(*args: object) -> str:
+        raise AssertionError("the diff was computed")
+
+    monkeypatch.setattr(pytest_sphinx, "_output_difference", output_difference)
+    pytester.makeconftest(
+        """
+        import pytest
+
+        def pytest_collection_modifyitems(items):
+            for item in items:
+                item.add_marker(pytest.mark.xfail)
+        """
+    )
+    pytester.maketxtfile(
+        test_something="""
+        .. testcode::
+
+            print(1)
+
+        .. testoutput::
+
+            2
+    """,
+    )
+
+    result = pytester.runpytest()
+    result.assert_outcomes(xfailed=1)
@@ -0,0 +1,127 @@
+import textwrap
+
+from _pytest.pytester import Pytester
+
+DOC = """
+    .. testcode::
+
+        x = 1
+
+    .. testcode::
+
+        y = x + 1
+
+    .. testcode::
+
+        print(y)
+
+    .. testoutput::
+
+        2
+"""
+
+
+def _make_conftest(pytester: Pytester, edits: list[list[tuple[str, str]]]) -> None:
+    # instead of waiting, edit the file and stop watching after the edits
+    pytester.makeconftest(
+        textwrap.dedent(
+            f"""
+            from pathlib import Path
+
+            import pytest_sphinx
+
+            EDITS = {edits!r}
+
+            def wait(self):
+                if not EDITS:
+                    raise KeyboardInterrupt
+                path = Path("test_something.txt")
+                text = path.read_text()
+                for old, new in EDITS.pop(0):
+                    text = text.replace(old, new)
+                path.write_text(text)
+
+            pytest_sphinx._Watcher.wait = wait
+            """
+        )
+    )
+
+
+def test_watch(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+    _make_conftest(
+        pytester,
+        [
+            [("print(y)", "print(y * 10)"), ("\n    2", "\n    20")],
+            [("y = x + 1", "y = x + 2")],
+        ],
+    )
+
+    result = pytester.runpytest_subprocess("--sphinx-watch")
+    result.stdout.fnmatch_lines(
+        [
+            "*= watching 1 file(s) for changes (Ctrl+C to stop) =*",
+            # only the changed example is run, with the globals from before it
+            "test_something.txt: ran 1 of 3 example(s), passed",
+            # the changed example and everything after it
+            "*Expected:",
+            "*    20",
+            "*Got:",
+            "*    30",
+            "test_something.txt: ran 2 of 3 example(s), failed",
+            "stopped watching",
+            "*1 passed*",
+        ]
+    )
+
+
+def test_watch_reruns_the_examples_of_other_groups(pytester: Pytester) -> None:
+    pytester.maketxtfile(
+        test_something="""
+        .. testcode:: a
+
+            x = 1
+
+        .. testcode:: b
+
+            y = 2
+
+        .. testcode:: a
+
+            print(x + y)
+
+        .. testoutput:: a
+
+            3
+    """
+    )
+    _make_conftest(pytester, [[("x = 1", "x = 1  # comment")]])
+
+    result = pytester.runpytest_subprocess("--sphinx-watch")
+    # all groups share one namespace, so y has to be defined again
+    result.stdout.fnmatch_lines(
+        ["test_something.txt: ran 3 of 3 example(s), passed", "stopped watching"]
+    )
+
+
+def test_no_watch_with_collect_only(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+
+    result = pytester.runpytest("--sphinx-watch", "--collect-only")
+    result.stdout.no_fnmatch_line("*watching*")
+
+
+def test_no_watch_with_xdist(pytester: Pytester) -> None:
+    pytester.maketxtfile(test_something=DOC)
+    # the option of pytest-xdist
+    pytester.makeconftest(
+        """
+        def pytest_addoption(parser):
+            parser.addoption("--dist", default="no")
+        """
+    )
+
+    result = pytester.runpytest("--sphinx-watch", "--dist=load")
+    result.stderr.fnmatch_lines(
+        ["ERROR: --sphinx-watch cannot be used with pytest-xdist"]
+    )